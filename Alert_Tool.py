@@ -1,9 +1,16 @@
-import json
+import argparse
+import logging
 from influxdb_client import InfluxDBClient
-import requests
 import os
+import time
 from datetime import datetime
+import numpy as np
 import pytz
+from alert_dispatch import AlertDispatcher
+from ingest import metrics
+from ingest.transform import field_names, from_ns
+from reference_stats import ReferenceStats
+from reference_store import open_reference_store
 
 # InfluxDB settings
 influxdb_url = os.environ.get("INFLUX_URL")
@@ -11,45 +18,68 @@ influxdb_token = os.environ.get("INFLUX_TOKEN")
 influxdb_org = os.environ.get("INFLUX_ORG")
 influxdb_bucket = os.environ.get("INFLUX_BUCKET")
 
-# Pushover settings
-pushover_token = os.environ.get("PO_TOKEN")
-pushover_user = os.environ.get("PO_USER")
-
-reference_file_path = 'reference_values.json'
-
 # Thresholds
 lower_threshold = -0.002
 upper_threshold = 0.002
 
-def load_reference_values():
-    try:
-        with open(reference_file_path, 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
-
-def send_pushover_notification(message):
-    requests.post("https://api.pushover.net/1/messages.json", data={
-        "token": pushover_token,
-        "user": pushover_user,
-        "message": message
-    })
-
-def determine_location(piste):
-    if piste.startswith("8"):
-        return "Gummeruksenkatu"
-    elif piste.startswith("48"):
-        return "Ponttiseinä"
-    elif piste.startswith("4"):
-        return "Kilpisenkatu"
-    return "Unknown location"
-
-def is_outside_threshold(value, reference_value):
-    difference = value - reference_value
-    return difference < lower_threshold or difference > upper_threshold
+# Adaptive thresholds: with a positive value, the band of a point and axis widens to this many
+# standard deviations of its recent values when they scatter more than the fixed thresholds allow
+adaptive_sigma = float(os.environ.get("ALERT_ADAPTIVE_SIGMA", 0))
+
+delta_fields = ['DeltaX', 'DeltaY', 'DeltaZ']
+delta_mapping = {
+    'DeltaX': 'ΔX',
+    'DeltaY': 'ΔY',
+    'DeltaZ': 'ΔZ',
+}
 
-def query_and_alert():
-    reference_values = load_reference_values()
+def is_outside_threshold(value, reference_value, band=None):
+    lower, upper = band or (lower_threshold, upper_threshold)
+    difference = value - reference_value
+    return difference < lower or difference > upper
+
+# Function to look up the threshold band of a point and axis, the fixed one unless adaptive thresholds are on
+def threshold_band(stats, piste, field_name):
+    deviation = stats.deviation(piste, field_name) if stats else None
+    if deviation is None:
+        return lower_threshold, upper_threshold
+    width = adaptive_sigma * deviation
+    return min(lower_threshold, -width), max(upper_threshold, width)
+
+def load_stats():
+    return ReferenceStats() if adaptive_sigma > 0 else None
+
+def format_alert_message(piste, reference_point, field_name, value, reference_value, helsinki_timezone):
+    field_name_display = delta_mapping.get(field_name, field_name)
+    # The reference timestamp is already parsed into Helsinki time by the reference store
+    formatted_reference_timestamp = reference_point.updated.strftime("%d-%m-%Y %H:%M:%S") if reference_point.updated else 'N/A'
+
+    # Convert current UTC time to Helsinki timezone
+    current_timestamp_helsinki = datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(helsinki_timezone)
+    current_timestamp_formatted = current_timestamp_helsinki.strftime("%d-%m-%Y %H:%M:%S")
+
+    return (f"Mittaus: {reference_point.session}\n"
+            f"Mittapiste: {piste} ({reference_point.location})\n"
+            f"Akseli: {field_name_display}\n"
+            f"Arvo: {value:.3f}\n"
+            f"Vertailuarvo: {reference_value:.3f}\n"
+            f"Vertailuarvo päivitetty: {formatted_reference_timestamp}\n"
+            f"Aika: {current_timestamp_formatted}")
+
+# One line summary of a breach, used when several breaches of a location are sent as one digest
+def format_alert_summary(piste, reference_point, field_name, value, reference_value):
+    field_name_display = delta_mapping.get(field_name, field_name)
+    return (f"{piste} {field_name_display}: {value:.3f} "
+            f"(vertailuarvo {reference_value:.3f}, mittaus {reference_point.session})")
+
+def report_breach(dispatcher, piste, reference_point, field_name, value, reference_value, helsinki_timezone, point_time=None):
+    message = format_alert_message(piste, reference_point, field_name, value, reference_value, helsinki_timezone)
+    summary = format_alert_summary(piste, reference_point, field_name, value, reference_value)
+    dispatcher.add(piste, field_name, reference_point.location, message, summary, point_time)
+
+def query_and_alert(dispatcher):
+    reference_values = open_reference_store().load()
+    stats = load_stats()
     alerts_triggered = False
 
     # Define Helsinki timezone
@@ -62,51 +92,164 @@ def query_and_alert():
         |> filter(fn: (r) => r._measurement == "monitorointi" and (r._field == "DeltaX" or r._field == "DeltaY" or r._field == "DeltaZ"))
         |> sort(columns: ["_time"], desc: true)
         '''
-        result = client.query_api().query(org=influxdb_org, query=query)
-
-        for table in result:
-            for record in table.records:
-                piste = record.values['Piste']
-                field_name = record.get_field()
-                value = record.get_value()
-                if piste in reference_values:
-                    reference_point_info = reference_values[piste]
-                    reference_value = reference_point_info.get(field_name, 0)
-                    reference_timestamp = reference_point_info.get('timestamp', 'N/A')
-
-                    # Define field_name_display outside the if condition
-                    delta_mapping = {
-                        'DeltaX': 'ΔX',
-                        'DeltaY': 'ΔY',
-                        'DeltaZ': 'ΔZ',
-                    }
-                    field_name_display = delta_mapping.get(field_name, field_name)  # Ensure it has a value regardless of the threshold check
-
-                    # Parse and convert the reference timestamp to Helsinki timezone
-                    if reference_timestamp != 'N/A':
-                        reference_timestamp_datetime = datetime.fromisoformat(reference_timestamp.rstrip('Z')).replace(tzinfo=pytz.utc)
-                        reference_timestamp_helsinki = reference_timestamp_datetime.astimezone(helsinki_timezone)
-                        formatted_reference_timestamp = reference_timestamp_helsinki.strftime("%d-%m-%Y %H:%M:%S")
-                    else:
-                        formatted_reference_timestamp = 'N/A'
-
-                    # Convert current UTC time to Helsinki timezone
-                    current_timestamp_helsinki = datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(helsinki_timezone)
-                    current_timestamp_formatted = current_timestamp_helsinki.strftime("%d-%m-%Y %H:%M:%S")
-                    
-                    if is_outside_threshold(value, reference_value):
-                        alerts_triggered = True
-                        message = (f"Mittaus: {reference_point_info['session']}\n"
-                                f"Mittapiste: {piste} ({determine_location(piste)})\n"
-                                f"Akseli: {field_name_display}\n"
-                                f"Arvo: {value:.3f}\n"
-                                f"Vertailuarvo: {reference_value:.3f}\n"
-                                f"Vertailuarvo päivitetty: {formatted_reference_timestamp}\n"
-                                f"Aika: {current_timestamp_formatted}")
-                        send_pushover_notification(message)
+        with metrics.stage('query'):
+            result = client.query_api().query(org=influxdb_org, query=query)
+
+        with metrics.stage('evaluate'):
+            for table in result:
+                metrics.count('records', len(table.records))
+                for record in table.records:
+                    piste = record.values['Piste']
+                    field_name = record.get_field()
+                    value = record.get_value()
+                    if piste in reference_values:
+                        reference_point = reference_values[piste]
+                        reference_value = getattr(reference_point, field_name)
+
+                        if is_outside_threshold(value, reference_value, threshold_band(stats, piste, field_name)):
+                            alerts_triggered = True
+                            metrics.count('breaches')
+                            report_breach(dispatcher, piste, reference_point, field_name, value, reference_value, helsinki_timezone, record.get_time())
 
         if not alerts_triggered:
             print("Arvot Ok")
 
+def flux_string(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+# Reference values as a Flux table, one row per Piste, missing axes default to 0 like in query_and_alert
+def reference_table(reference_values):
+    rows = []
+    for piste, reference_point in reference_values.items():
+        columns = [f"Piste: {flux_string(piste)}"]
+        # Flux float literals have no exponent form, so values are always written in fixed point
+        columns += [f"ref{field_name}: {float(getattr(reference_point, field_name) or 0):.9f}" for field_name in delta_fields]
+        rows.append("{" + ", ".join(columns) + "}")
+    return "array.from(rows: [\n            " + ",\n            ".join(rows) + "\n        ])"
+
+# Evaluates the thresholds inside InfluxDB: the latest value per Piste and axis is pivoted into one row
+# per Piste, joined with the reference values and only rows outside the thresholds are returned.
+# Adaptive bands are never narrower than the fixed ones, so they are applied to the returned rows here.
+def query_and_alert_server_side(dispatcher):
+    reference_values = open_reference_store().load()
+    stats = load_stats()
+    alerts_triggered = False
+
+    # Define Helsinki timezone
+    helsinki_timezone = pytz.timezone('Europe/Helsinki')
+
+    if reference_values:
+        outside = " or ".join(f"(exists r.{field_name} and ((r.{field_name} - r.ref{field_name}) < {lower_threshold} or (r.{field_name} - r.ref{field_name}) > {upper_threshold}))"
+                              for field_name in delta_fields)
+        query = f'''
+        import "array"
+
+        references = {reference_table(reference_values)}
+
+        latest = from(bucket: "{influxdb_bucket}")
+        |> range(start: -2h)
+        |> filter(fn: (r) => r._measurement == "monitorointi" and (r._field == "DeltaX" or r._field == "DeltaY" or r._field == "DeltaZ"))
+        |> group(columns: ["Piste", "_field"])
+        |> sort(columns: ["_time"])
+        |> last()
+        |> group()
+        |> pivot(rowKey: ["Piste"], columnKey: ["_field"], valueColumn: "_value")
+
+        join(tables: {{latest: latest, reference: references}}, on: ["Piste"])
+        |> filter(fn: (r) => {outside})
+        '''
+
+        with InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org) as client, metrics.stage('query'):
+            result = client.query_api().query(org=influxdb_org, query=query)
+
+        with metrics.stage('evaluate'):
+            for table in result:
+                metrics.count('records', len(table.records))
+                for record in table.records:
+                    piste = record.values['Piste']
+                    reference_point = reference_values[piste]
+                    for field_name in delta_fields:
+                        value = record.values.get(field_name)
+                        reference_value = record.values[f"ref{field_name}"]
+                        if value is not None and is_outside_threshold(value, reference_value, threshold_band(stats, piste, field_name)):
+                            alerts_triggered = True
+                            metrics.count('breaches')
+                            report_breach(dispatcher, piste, reference_point, field_name, value, reference_value, helsinki_timezone)
+
+    if not alerts_triggered:
+        print("Arvot Ok")
+
+# Points older than this are not alerted on during ingest, the same window query_and_alert reads
+alert_window_ns = 2 * 3600 * 1_000_000_000
+
+# Checks worksheets against the reference values while XML_DB_LOG.py writes them, so new points are
+# alerted on without querying them back. Values are compared like in query_and_alert, and the newest
+# breach of each point and axis is the one reported. Backlogs and old reports stay quiet.
+class WorksheetAlerts:
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.store = open_reference_store()
+        self.stats = load_stats()
+        self.helsinki_timezone = pytz.timezone('Europe/Helsinki')
+
+    # Function to check the selected rows of a worksheet, breaches are queued on the dispatcher
+    def evaluate(self, piste, worksheet, selected):
+        # Served from the store's cache unless update_reference.py changed the values
+        reference_values = self.store.load()
+        recent = selected & (worksheet.time_ns >= time.time_ns() - alert_window_ns)
+        if piste not in reference_values or not recent.any():
+            return
+        reference_point = reference_values[piste]
+        indices = np.flatnonzero(recent)
+        metrics.count('records', len(indices) * len(delta_fields))
+        for field_name in delta_fields:
+            values = worksheet.values[indices, field_names.index(field_name)]
+            reference_value = getattr(reference_point, field_name)
+            lower, upper = threshold_band(self.stats, piste, field_name)
+            outside = np.flatnonzero((values - reference_value < lower) | (values - reference_value > upper))
+            if len(outside):
+                metrics.count('breaches', len(outside))
+                newest = outside[np.argmax(worksheet.time_ns[indices[outside]])]
+                report_breach(self.dispatcher, piste, reference_point, field_name, float(values[newest]), reference_value,
+                              self.helsinki_timezone, from_ns(worksheet.time_ns[indices[newest]]))
+
+    # Function to send the queued breaches, returns the number of alerts sent
+    def dispatch(self):
+        with metrics.stage('dispatch'):
+            sent = self.dispatcher.dispatch()
+        metrics.count('alerts_sent', sent)
+        metrics.count('alerts_suppressed', len(self.dispatcher.suppressed))
+        if sent:
+            logging.info(f"{sent} alerts sent.")
+        self.dispatcher.suppressed = set()
+        # Picks up statistics written by update_reference.py since the last pass
+        self.stats = load_stats()
+        return sent
+
+    def close(self):
+        self.dispatcher.close()
+
 if __name__ == "__main__":
-    query_and_alert()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Send Pushover alerts for points that moved away from their reference values.")
+    parser.add_argument('--server-side', action='store_true', help="evaluate only the latest value per point and axis inside InfluxDB")
+    args = parser.parse_args()
+
+    metrics.start_run('alert')
+    dispatcher = AlertDispatcher()
+    try:
+        with metrics.profiled('alert'):
+            if args.server_side:
+                query_and_alert_server_side(dispatcher)
+            else:
+                query_and_alert(dispatcher)
+            with metrics.stage('dispatch'):
+                sent = dispatcher.dispatch()
+        metrics.count('alerts_sent', sent)
+        metrics.count('alerts_suppressed', len(dispatcher.suppressed))
+        if sent:
+            print(f"{sent} hälytystä lähetetty.")
+        if dispatcher.suppressed:
+            print(f"{len(dispatcher.suppressed)} toistuvaa hälytystä ohitettu.")
+    finally:
+        dispatcher.close()
+        metrics.export()
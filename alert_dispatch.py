@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+import pytz
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pushover settings
+pushover_url = os.environ.get("PO_URL", "https://api.pushover.net/1/messages.json")
+pushover_token = os.environ.get("PO_TOKEN")
+pushover_user = os.environ.get("PO_USER")
+pushover_timeout = float(os.environ.get("PO_TIMEOUT", "10"))
+pushover_retries = int(os.environ.get("PO_RETRIES", "3"))
+pushover_backoff = float(os.environ.get("PO_BACKOFF", "1"))
+
+# Alerts for the same point and axis are not repeated within the cooldown, in seconds
+alert_state_path = os.environ.get("ALERT_STATE_FILE", "alert_state.json")
+alert_cooldown = int(os.environ.get("ALERT_COOLDOWN", "21600"))
+
+# Pushover truncates longer messages
+max_message_length = 1024
+
+# Function to create a pooled session that retries failed requests with exponential backoff
+def create_session(retries=pushover_retries, backoff=pushover_backoff):
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['POST']), raise_on_status=False)
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    return session
+
+def send_pushover_notification(session, message, title=None):
+    data = {
+        "token": pushover_token,
+        "user": pushover_user,
+        "message": message
+    }
+    if title:
+        data["title"] = title
+    response = session.post(pushover_url, data=data, timeout=pushover_timeout)
+    response.raise_for_status()
+
+def load_alert_state(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Function to save the alert state, written to a temporary file first so a crash never leaves it half written
+def save_alert_state(path, state):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(temporary_path, path)
+
+def alert_key(piste, field_name):
+    return f"{piste}/{field_name}"
+
+# Collects the threshold breaches of one run and sends them as one digest per location.
+# A (Piste, axis) pair alerted within the cooldown is suppressed. Only one breach per pair is kept: one with
+# a newer point_time replaces the queued one, otherwise the first one stays, which is the latest one when
+# the records come sorted newest first.
+class AlertDispatcher:
+    def __init__(self, session=None, state_path=alert_state_path, cooldown=alert_cooldown):
+        self.session = session or create_session()
+        self.state_path = state_path
+        self.cooldown = cooldown
+        self.state = load_alert_state(state_path)
+        self.pending = {}
+        self.suppressed = set()
+
+    def add(self, piste, field_name, location, message, summary, point_time=None):
+        key = alert_key(piste, field_name)
+        for alerts in self.pending.values():
+            if key in alerts:
+                queued_time = alerts[key][2]
+                if point_time is not None and (queued_time is None or point_time > queued_time):
+                    alerts[key] = (message, summary, point_time)
+                return
+        if time.time() - self.state.get(key, 0) < self.cooldown:
+            self.suppressed.add(key)
+            return
+        self.pending.setdefault(location, {})[key] = (message, summary, point_time)
+
+    # Function to build the digest of one location, a single breach keeps its full message
+    def digest(self, location, alerts):
+        if len(alerts) == 1:
+            message, summary, point_time = next(iter(alerts.values()))
+            return None, message
+
+        current_timestamp_helsinki = datetime.utcnow().replace(tzinfo=pytz.utc).astimezone(pytz.timezone('Europe/Helsinki'))
+        footer = f"Aika: {current_timestamp_helsinki.strftime('%d-%m-%Y %H:%M:%S')}"
+        summaries = [summary for message, summary, point_time in alerts.values()]
+        lines = summaries
+        kept = len(summaries)
+        while kept > 1 and len("\n".join(lines + [footer])) > max_message_length:
+            kept -= 1
+            lines = summaries[:kept] + [f"... ja {len(summaries) - kept} muuta"]
+        return f"{location}: {len(alerts)} poikkeamaa", "\n".join(lines + [footer])
+
+    # Function to send the collected digests, returns the number of breaches delivered.
+    # Breaches that fail to send are not recorded and stay queued, so a dispatcher that lives on, as in
+    # the ingest daemon, sends them with its next dispatch, and the next Alert_Tool.py run finds them again.
+    def dispatch(self):
+        sent = 0
+        now = time.time()
+        failed = {}
+        for location, alerts in self.pending.items():
+            title, message = self.digest(location, alerts)
+            try:
+                send_pushover_notification(self.session, message, title)
+            except requests.RequestException as e:
+                logging.error(f"Sending alert for {location} failed: {e}")
+                failed[location] = alerts
+                continue
+            for key in alerts:
+                self.state[key] = now
+            sent += len(alerts)
+
+        self.pending = failed
+        # Drop entries whose cooldown has passed so the state file does not grow forever
+        self.state = {key: sent_at for key, sent_at in self.state.items() if now - sent_at < self.cooldown}
+        save_alert_state(self.state_path, self.state)
+        return sent
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,19 @@
+import argparse
+import logging
+from ingest.backfill import run_backfill
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Load exported ReportPoints XML files into InfluxDB without going through email.")
+    parser.add_argument('paths', nargs='+', help="report files, directories, zip archives, mbox files or maildir directories")
+    parser.add_argument('--output', help="write line protocol to this file (.lp or .lp.gz) instead of InfluxDB")
+    parser.add_argument('--workers', type=int, help="parser processes (default: number of CPUs)")
+    parser.add_argument('--no-existing-check', action='store_true', help="do not query InfluxDB for points it already has, e.g. after a bucket wipe")
+    parser.add_argument('--verbose', action='store_true', help="log every report")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    run_backfill(args.paths, args.output, args.workers, not args.no_existing_check)
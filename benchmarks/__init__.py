@@ -0,0 +1 @@
+# Offline benchmarks: python -m benchmarks.run from the repository root
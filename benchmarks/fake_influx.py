@@ -0,0 +1,181 @@
+import gzip
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Unescaped separators of line protocol
+tag_separator = re.compile(r'(?<!\\),')
+field_separator = re.compile(r'(?<!\\)=')
+duration_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+range_pattern = re.compile(r'range\(start: ([^,)]+)(?:, stop: ([^)]+))?\)')
+measurement_pattern = re.compile(r'r\._measurement == "([^"]*)"')
+piste_pattern = re.compile(r'r\.Piste == "([^"]*)"')
+field_pattern = re.compile(r'r\._field == "([^"]*)"')
+
+def unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+# Function to parse one line of line protocol into measurement, tags, fields and epoch-ns time
+def parse_line(line):
+    series, fields, time_ns = line.rsplit(' ', 2)
+    measurement, *tags = tag_separator.split(series)
+    tags = dict(unescape(tag).split('=', 1) for tag in tags)
+    fields = {key: float(value.rstrip('i')) for key, value in (field_separator.split(field, 1) for field in fields.split(','))}
+    return unescape(measurement), tags, fields, int(time_ns)
+
+# Function to turn a Flux time, absolute or relative like -2h, into epoch nanoseconds
+def flux_time_ns(text, now_ns):
+    text = text.strip()
+    if text.startswith('-'):
+        return now_ns - int(text[1:-1]) * duration_units[text[-1]] * 1_000_000_000
+    if text == 'now()':
+        return now_ns
+    timestamp = datetime.strptime(text, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp()) * 1_000_000_000
+
+def rfc3339(time_ns):
+    return datetime.fromtimestamp(time_ns // 1_000_000_000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# Stand-in for the InfluxDB 2 HTTP API on localhost. Writes are parsed and kept in memory, and queries
+# understand the range/filter shapes used by this project: the dedupe check that keeps only _time, and
+# the record listing of Alert_Tool. Pushover posts are accepted as well, so alerts can be sent to it.
+class FakeInflux:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.points = {}
+        self.requests = Counter()
+        self.notifications = []
+        handler = type('FakeInfluxHandler', (FakeInfluxHandler,), {'influx': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-influx', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def clear(self):
+        with self.lock:
+            self.points = {}
+            self.requests = Counter()
+            self.notifications = []
+
+    def point_count(self):
+        with self.lock:
+            return sum(len(series) for series in self.points.values())
+
+    def write(self, body):
+        lines = [line for line in body.decode('utf-8').split('\n') if line]
+        with self.lock:
+            for line in lines:
+                measurement, tags, fields, time_ns = parse_line(line)
+                series = self.points.setdefault((measurement, tags.get('Piste')), {})
+                stored_fields = series.get(time_ns, (tags, {}))[1]
+                series[time_ns] = (tags, {**stored_fields, **fields})
+
+    # Function to answer a Flux query with annotated CSV
+    def query(self, flux):
+        now_ns = time.time_ns()
+        start, stop = range_pattern.search(flux).groups()
+        start_ns = flux_time_ns(start, now_ns)
+        stop_ns = flux_time_ns(stop, now_ns) if stop else now_ns
+        measurement = measurement_pattern.search(flux)
+        piste = piste_pattern.search(flux)
+        wanted_fields = set(field_pattern.findall(flux))
+
+        records = []
+        with self.lock:
+            for (series_measurement, series_piste), series in self.points.items():
+                if measurement and series_measurement != measurement.group(1):
+                    continue
+                if piste and series_piste != piste.group(1):
+                    continue
+                for time_ns, (tags, fields) in series.items():
+                    if not start_ns <= time_ns < stop_ns:
+                        continue
+                    for field, value in fields.items():
+                        if not wanted_fields or field in wanted_fields:
+                            records.append((time_ns, field, value, series_measurement, tags))
+        records.sort(key=lambda record: record[0], reverse='desc: true' in flux)
+
+        if 'keep(columns: ["_time"])' in flux:
+            lines = ['#datatype,string,long,dateTime:RFC3339', '#group,false,false,false', '#default,_result,,',
+                     ',result,table,_time']
+            lines += [f",,0,{rfc3339(time_ns)}" for time_ns, *_ in records]
+        else:
+            lines = ['#datatype,string,long,dateTime:RFC3339,double,string,string,string,string',
+                     '#group,false,false,false,false,true,true,true,true',
+                     '#default,_result,,,,,,,',
+                     ',result,table,_time,_value,_field,_measurement,Piste,Istunto']
+            lines += [f",,0,{rfc3339(time_ns)},{value!r},{field},{series_measurement},{tags.get('Piste', '')},{tags.get('Istunto', '')}"
+                      for time_ns, field, value, series_measurement, tags in records]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+class FakeInfluxHandler(BaseHTTPRequestHandler):
+    influx = None
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, without this every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def respond(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        self.influx.requests[path] += 1
+        if path in ('/ping', '/health'):
+            self.respond(200, b'{"status":"pass"}')
+        else:
+            self.respond(404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+        self.influx.requests[path] += 1
+        if self.influx.latency:
+            time.sleep(self.influx.latency)
+        if path == '/api/v2/write':
+            self.influx.write(body)
+            self.respond(204)
+        elif path == '/api/v2/query':
+            self.respond(200, self.influx.query(json.loads(body)['query']), 'text/csv; charset=utf-8')
+        elif path == '/1/messages.json':
+            self.influx.notifications.append(body)
+            self.respond(200, b'{"status":1}')
+        else:
+            self.respond(404)
+
+    def log_message(self, format, *args):
+        pass
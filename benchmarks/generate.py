@@ -0,0 +1,103 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+# Piste ids of the real installation, extra worksheets get made up ids
+piste_ids = ['806', '807', '809', '810', '811', '821', '411', '413', '414', '415', '416', '417',
+             '418', '419', '420', '421', '422', '423', '482', '483', '484', '486', '487', '488']
+
+# Rough coordinates of the measured points
+base_y = 6672000.0
+base_x = 25490000.0
+base_z = 12.0
+
+header = '''<?xml version="1.0"?>
+<?mso-application progid="Excel.Sheet"?>
+<Workbook xmlns="urn:schemas-microsoft-com:office:spreadsheet"
+ xmlns:o="urn:schemas-microsoft-com:office:office"
+ xmlns:x="urn:schemas-microsoft-com:office:excel"
+ xmlns:ss="urn:schemas-microsoft-com:office:spreadsheet"
+ xmlns:html="http://www.w3.org/TR/REC-html40">
+'''
+
+def piste_id(index):
+    return piste_ids[index] if index < len(piste_ids) else f"9{index:03d}"
+
+def cell(text, index=None):
+    skip = f' ss:Index="{index}"' if index else ''
+    return f'<Cell{skip}><Data ss:Type="String">{escape(text)}</Data></Cell>'
+
+def number(value, decimals, comma_decimals):
+    text = f"{value:.{decimals}f}"
+    return text.replace('.', ',') if comma_decimals else text
+
+# Function to render one data row, missing cells are left out and the next cell carries an ss:Index
+def data_row(values):
+    cells = []
+    skipped = False
+    for column, value in enumerate(values, start=1):
+        if value is None:
+            skipped = True
+            continue
+        cells.append(cell(value, column if skipped else None))
+        skipped = False
+    return f'   <Row>{"".join(cells)}</Row>\n'
+
+def worksheet(piste, rows, start, interval, flipped, comma_decimals, missing_share, exceed_share, rng):
+    parts = [f' <Worksheet ss:Name="{piste}">\n  <Table>\n',
+             f'   <Row>{cell("Mittauspisteen raportti")}</Row>\n',
+             f'   <Row>{cell(piste)}</Row>\n',
+             '   <Row/>\n',
+             f'   <Row>{"".join(cell(name) for name in ("Istunto", "Pvm", "Y", "X", "Z", "dY", "dX", "dZ"))}</Row>\n']
+    y = base_y + rng.uniform(0, 1000)
+    x = base_x + rng.uniform(0, 1000)
+    z = base_z + rng.uniform(0, 5)
+    session = 2000 + rng.randrange(1000)
+    for row in range(rows):
+        deltas = [rng.gauss(0, 0.002) for _ in range(3)]
+        if rng.random() < exceed_share:
+            deltas[rng.randrange(3)] = rng.choice((-1, 1)) * rng.uniform(0.2, 1.0)
+        dy, dx, dz = (number(delta, 3, comma_decimals) for delta in deltas)
+        coordinates = [number(y + deltas[0], 3, comma_decimals), number(x + deltas[1], 3, comma_decimals), number(z + deltas[2], 3, comma_decimals)]
+        timestamp = (start + timedelta(seconds=row * interval)).strftime('%d-%m-%Y %H.%M.%S')
+        if flipped:
+            values = [str(session + row), timestamp, coordinates[1], coordinates[0], coordinates[2], dx, dy, dz]
+        else:
+            values = [str(session + row), timestamp, coordinates[0], coordinates[1], coordinates[2], dy, dx, dz]
+        # The first row is kept whole so the axis orientation can always be detected
+        if row and rng.random() < missing_share:
+            values[rng.randrange(2, len(values))] = None
+        parts.append(data_row(values))
+    parts.append('  </Table>\n </Worksheet>\n')
+    return ''.join(parts)
+
+# Function to generate a ReportPoints workbook like the ones mailed by the measurement system.
+# The same arguments always give the same bytes. start is local Helsinki time, interval is in seconds.
+def generate_report(worksheets=10, rows=1000, flipped_share=0.2, comma_decimals=True, missing_share=0.01,
+                    exceed_share=0.001, start=datetime(2024, 3, 1), interval=3600, seed=0):
+    rng = random.Random(seed)
+    parts = [header]
+    for index in range(worksheets):
+        flipped = rng.random() < flipped_share
+        parts.append(worksheet(piste_id(index), rows, start, interval, flipped, comma_decimals, missing_share, exceed_share, rng))
+    parts.append('</Workbook>\n')
+    return ''.join(parts).encode('utf-8')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic ReportPoints XML workbook.")
+    parser.add_argument('output', help="file to write")
+    parser.add_argument('--worksheets', type=int, default=10, help="worksheets, i.e. points (default 10)")
+    parser.add_argument('--rows', type=int, default=1000, help="data rows per worksheet (default 1000)")
+    parser.add_argument('--flipped-share', type=float, default=0.2, help="share of worksheets with X and Y swapped (default 0.2)")
+    parser.add_argument('--dot-decimals', action='store_true', help="write 1.5 instead of 1,5")
+    parser.add_argument('--missing-share', type=float, default=0.01, help="share of rows with a missing cell (default 0.01)")
+    parser.add_argument('--exceed-share', type=float, default=0.001, help="share of rows with a delta above the threshold (default 0.001)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = generate_report(args.worksheets, args.rows, args.flipped_share, not args.dot_decimals,
+                             args.missing_share, args.exceed_share, seed=args.seed)
+    with open(args.output, 'wb') as file:
+        file.write(report)
+    print(f"{len(report) / 1e6:.1f} MB written to {args.output}.")
@@ -0,0 +1,202 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pytz
+import Alert_Tool
+import alert_dispatch
+import reference_store
+from benchmarks.fake_influx import FakeInflux
+from benchmarks.generate import generate_report, piste_id
+from ingest import config
+from ingest.dedupe import group_by_piste, new_rows
+from ingest.ledger import IngestLedger
+from ingest.parse import iter_report_rows
+from ingest.report import process_xml_file
+from ingest.transform import convert_worksheet
+from ingest.write import connect_influx, write_worksheet
+
+# Timings of one benchmark stage: seconds per call and the rows handled
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.rows = 0
+        self.peak_rss = 0
+
+    def time(self, function, *args, rows=0):
+        started = time.perf_counter()
+        result = function(*args)
+        self.durations.append(time.perf_counter() - started)
+        self.rows += rows(result) if callable(rows) else rows
+        return result
+
+    def finish(self):
+        self.peak_rss = peak_rss_mb()
+
+    def summary(self):
+        durations = np.array(self.durations) * 1000
+        total = durations.sum() / 1000
+        return {
+            'stage': self.name,
+            'calls': len(durations),
+            'rows': self.rows,
+            'total_s': round(float(total), 4),
+            'rows_per_s': round(self.rows / total) if total else 0,
+            'mean_ms': round(float(durations.mean()), 3) if len(durations) else 0,
+            'p95_ms': round(float(np.percentile(durations, 95)), 3) if len(durations) else 0,
+            'max_ms': round(float(durations.max()), 3) if len(durations) else 0,
+            'peak_rss_mb': round(self.peak_rss, 1),
+        }
+
+# Function to read the peak resident set size of this process so far, ru_maxrss is in KB on Linux and bytes on macOS
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+# Function to point the ingest and alert code at the fake server
+def use_fake_influx(influx):
+    config.influxdb_url = influx.url
+    config.influxdb_token = 'benchmark'
+    config.influxdb_org = 'benchmark'
+    config.influxdb_bucket = 'benchmark'
+
+def bench_parse(reports):
+    stage = Stage('parse')
+    parsed = [stage.time(lambda report: list(iter_report_rows(report)), report, rows=len) for report in reports]
+    stage.finish()
+    return stage, parsed
+
+def bench_transform(parsed):
+    stage = Stage('transform')
+    worksheets = []
+    for rows in parsed:
+        for piste_name, worksheet_points in group_by_piste(rows):
+            worksheet_points = list(worksheet_points)
+            worksheets.append((piste_name, stage.time(convert_worksheet, worksheet_points, config.local_tz, config.threshold, rows=len(worksheet_points))))
+    stage.finish()
+    return stage, worksheets
+
+def bench_dedupe(name, client, worksheets):
+    stage = Stage(name)
+    for piste_name, worksheet in worksheets:
+        pending = worksheet.valid_time
+        if pending.any():
+            stage.time(new_rows, client, config.influxdb_bucket, config.measurement_name, piste_name, worksheet, pending, rows=len(worksheet.rows))
+    stage.finish()
+    return stage
+
+def bench_write(writer, worksheets):
+    stage = Stage('write')
+    for piste_name, worksheet in worksheets:
+        selected = worksheet.valid_time & worksheet.within_threshold & worksheet.complete
+        stage.time(write_worksheet, writer, config.measurement_name, worksheet, selected, rows=lambda written: written)
+    stage.time(writer.flush)
+    stage.finish()
+    return stage
+
+def bench_end_to_end(client, writer, reports, directory):
+    stage = Stage('end_to_end')
+    ledger = IngestLedger(os.path.join(directory, 'ledger.db'))
+    try:
+        for index, report in enumerate(reports):
+            rows = sum(1 for _ in iter_report_rows(report))
+            stage.time(process_xml_file, report, client, writer, ledger, f"benchmark/{index}", f"ReportPoints_{index}.xml", rows=rows)
+    finally:
+        ledger.close()
+    stage.finish()
+    return stage
+
+# Function to time Alert_Tool against points from the last two hours, with reference values for every Piste
+def bench_alert(influx, client, writer, worksheets, directory):
+    stage = Stage('alert')
+    start = datetime.now(pytz.timezone('Europe/Helsinki')).replace(tzinfo=None) - timedelta(minutes=100)
+    report = generate_report(worksheets, rows=90, start=start, interval=60, seed=1)
+    for piste_name, worksheet_points in group_by_piste(iter_report_rows(report)):
+        worksheet = convert_worksheet(list(worksheet_points), config.local_tz, config.threshold)
+        write_worksheet(writer, config.measurement_name, worksheet, worksheet.valid_time & worksheet.within_threshold & worksheet.complete)
+    writer.flush()
+    records = influx.point_count() * 3
+
+    reference_path = os.path.join(directory, 'reference_values.json')
+    with open(reference_path, 'w') as file:
+        json.dump({piste_id(index): {'session': '1', 'timestamp': '2024-03-07T07:59:42Z', 'DeltaX': 0.0, 'DeltaY': 0.0, 'DeltaZ': 0.0}
+                   for index in range(worksheets)}, file)
+    reference_store.reference_file_path = reference_path
+    Alert_Tool.influxdb_url = influx.url
+    Alert_Tool.influxdb_token = config.influxdb_token
+    Alert_Tool.influxdb_org = config.influxdb_org
+    Alert_Tool.influxdb_bucket = config.influxdb_bucket
+    alert_dispatch.pushover_url = f"{influx.url}/1/messages.json"
+
+    dispatcher = alert_dispatch.AlertDispatcher(state_path=os.path.join(directory, 'alert_state.json'), cooldown=0)
+    try:
+        stage.time(Alert_Tool.query_and_alert, dispatcher, rows=records)
+        stage.time(dispatcher.dispatch)
+    finally:
+        dispatcher.close()
+    stage.finish()
+    return stage
+
+# Function to run every stage on the same generated reports, returns one summary per stage
+def run_benchmarks(reports=4, worksheets=10, rows=1000, flipped_share=0.2, comma_decimals=True, missing_share=0.01, seed=0, alert=True):
+    generated = [generate_report(worksheets, rows, flipped_share, comma_decimals, missing_share, seed=seed + index) for index in range(reports)]
+    logging.info(f"Generated {reports} reports, {sum(len(report) for report in generated) / 1e6:.1f} MB.")
+
+    with FakeInflux() as influx, tempfile.TemporaryDirectory() as directory:
+        use_fake_influx(influx)
+        client, writer = connect_influx()
+        try:
+            stages = []
+            parse, parsed = bench_parse(generated)
+            transform, converted = bench_transform(parsed)
+            del parsed
+            stages += [parse, transform]
+            stages.append(bench_dedupe('dedupe_empty', client, converted))
+            stages.append(bench_write(writer, converted))
+            stages.append(bench_dedupe('dedupe_stored', client, converted))
+            del converted
+
+            influx.clear()
+            stages.append(bench_end_to_end(client, writer, generated, directory))
+            if alert:
+                influx.clear()
+                stages.append(bench_alert(influx, client, writer, worksheets, directory))
+        finally:
+            writer.close()
+            client.close()
+    return [stage.summary() for stage in stages]
+
+def print_summaries(summaries):
+    columns = ['stage', 'calls', 'rows', 'total_s', 'rows_per_s', 'mean_ms', 'p95_ms', 'max_ms', 'peak_rss_mb']
+    widths = [max(len(column), *(len(str(summary[column])) for summary in summaries)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for summary in summaries:
+        print('  '.join(str(summary[column]).ljust(width) for column, width in zip(columns, widths)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parsing, dedupe, writing and alerting against a local fake InfluxDB.")
+    parser.add_argument('--reports', type=int, default=4, help="generated reports (default 4)")
+    parser.add_argument('--worksheets', type=int, default=10, help="worksheets per report (default 10)")
+    parser.add_argument('--rows', type=int, default=1000, help="data rows per worksheet (default 1000)")
+    parser.add_argument('--flipped-share', type=float, default=0.2, help="share of worksheets with X and Y swapped (default 0.2)")
+    parser.add_argument('--dot-decimals', action='store_true', help="write 1.5 instead of 1,5")
+    parser.add_argument('--missing-share', type=float, default=0.01, help="share of rows with a missing cell (default 0.01)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-alert', action='store_true', help="skip the Alert_Tool stage")
+    parser.add_argument('--json', help="also write the results to this file, for comparing runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    summaries = run_benchmarks(args.reports, args.worksheets, args.rows, args.flipped_share, not args.dot_decimals,
+                               args.missing_share, args.seed, not args.no_alert)
+    print_summaries(summaries)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'arguments': vars(args), 'stages': summaries}, file, indent=4)
@@ -0,0 +1,10 @@
+# Ingest library shared by XML_DB_LOG.py and monitorointi_email.py.
+# backfill.py loads exported reports from disk without going through IMAP.
+# Stages: parse (attachment -> rows), transform (rows -> columns), dedupe (drop stored points), write (line protocol).
+from .parse import iter_report_rows
+from .transform import convert_worksheet
+from .dedupe import new_rows
+from .write import BatchWriter, connect_influx, write_worksheet
+from .report import process_xml_file, write_data_to_influx
+from .runner import process_unseen, run_daemon, run_once
+from .backfill import run_backfill
@@ -0,0 +1,235 @@
+import gzip
+import logging
+import mailbox
+import mmap
+import os
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import config
+from .dedupe import DedupeUnavailable, existing_timestamps, group_by_piste
+from .imap_fetch import is_report_filename
+from .ledger import report_hash
+from .parse import iter_report_rows
+from .transform import convert_worksheet, from_ns, to_ns, unique_time_indices, worksheet_lines
+from .write import connect_influx
+
+# Seconds between progress lines
+progress_interval = 5
+
+# Worksheets per Piste whose timestamps are remembered to drop points repeated by overlapping reports.
+# Bounded so memory does not grow with the backlog, older repeats are rewritten with the same values.
+recent_worksheets = 16
+
+# Kinds of backfill jobs: a report file on disk, a member of a zip archive, or an attachment already in memory
+file_job = 'file'
+zip_job = 'zip'
+content_job = 'content'
+
+# Function to list the report files of a zip archive
+def zip_jobs(path):
+    with zipfile.ZipFile(path) as archive:
+        return [(zip_job, path, name) for name in archive.namelist() if name.lower().endswith('.xml')]
+
+# Function to pull the ReportPoints attachments out of an mbox file or a maildir directory
+def mailbox_jobs(folder, path):
+    for message in folder:
+        for part in message.walk():
+            filename = part.get_filename()
+            if is_report_filename(filename):
+                yield (content_job, f"{path}:{filename}", part.get_payload(decode=True))
+
+def is_maildir(path):
+    return all(os.path.isdir(os.path.join(path, name)) for name in ('cur', 'new', 'tmp'))
+
+def is_mbox(path):
+    with open(path, 'rb') as file:
+        return file.read(5) == b'From '
+
+# Function to turn the given paths into backfill jobs. Directories are walked for .xml files, zip archives
+# and mbox files found on the way are opened as well. Maildir directories are read as mailboxes.
+def iter_jobs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            if is_maildir(path):
+                yield from mailbox_jobs(mailbox.Maildir(path, create=False), path)
+                continue
+            for directory, subdirectories, filenames in os.walk(path):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    file_path = os.path.join(directory, filename)
+                    if filename.lower().endswith('.xml'):
+                        yield (file_job, file_path, None)
+                    elif filename.lower().endswith('.zip'):
+                        yield from zip_jobs(file_path)
+                    elif filename.lower().endswith('.mbox'):
+                        yield from mailbox_jobs(mailbox.mbox(file_path, create=False), file_path)
+        elif zipfile.is_zipfile(path):
+            yield from zip_jobs(path)
+        elif is_mbox(path):
+            yield from mailbox_jobs(mailbox.mbox(path, create=False), path)
+        else:
+            yield (file_job, path, None)
+
+# Function to parse, convert and render one report in a worker process.
+# Files are memory-mapped and parsed in place. Returns the report's name, hash, size, row count, skip counts
+# and per worksheet the Piste, the timestamps and line protocol of its writable rows.
+def backfill_report(job):
+    kind, name, content = job
+    if kind == file_job:
+        if os.path.getsize(name) == 0:
+            return name, None, 0, 0, {}, [], "empty file"
+        with open(name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as report:
+            return convert_report(name, report, report_hash(report), len(report))
+    if kind == zip_job:
+        with zipfile.ZipFile(name) as archive:
+            content = archive.read(content)
+        name = f"{name}:{job[2]}"
+    return convert_report(name, content, report_hash(content), len(content))
+
+def convert_report(name, content, content_hash, size):
+    rows = 0
+    skipped = {'invalid time': 0, 'threshold': 0, 'missing fields': 0}
+    worksheets = []
+    try:
+        for piste_name, worksheet_points in group_by_piste(iter_report_rows(content)):
+            worksheet = convert_worksheet(list(worksheet_points), config.local_tz, config.threshold)
+            rows += len(worksheet.rows)
+            skipped['invalid time'] += int(np.count_nonzero(~worksheet.valid_time))
+            skipped['threshold'] += int(np.count_nonzero(worksheet.valid_time & ~worksheet.within_threshold))
+            skipped['missing fields'] += int(np.count_nonzero(worksheet.valid_time & worksheet.within_threshold & ~worksheet.complete))
+
+            indices = unique_time_indices(worksheet, worksheet.valid_time & worksheet.within_threshold & worksheet.complete)
+            if len(indices):
+                worksheets.append((piste_name, worksheet.time_ns[indices], list(worksheet_lines(config.measurement_name, worksheet, indices))))
+    except ET.ParseError as e:
+        return name, content_hash, size, rows, skipped, [], f"XML parse error: {e}"
+    return name, content_hash, size, rows, skipped, worksheets, None
+
+# Writes line protocol to a file for `influx write`, gzip compressed when the name ends in .gz
+class LineFileWriter:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', encoding='utf-8') if path.endswith('.gz') else open(path, 'w', encoding='utf-8')
+
+    def add(self, line):
+        self.file.write(line)
+        self.file.write('\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Running totals of a backfill, logged every progress_interval seconds and at the end
+class BackfillProgress:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.reports = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.bytes = 0
+        self.rows = 0
+        self.written = 0
+        self.existing = 0
+        self.skipped = {}
+
+    def add(self, size, rows, skipped):
+        self.reports += 1
+        self.bytes += size
+        self.rows += rows
+        for reason, count in skipped.items():
+            self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+    def log(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < progress_interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        logging.info(f"{self.reports} reports, {self.bytes / 1e6:.1f} MB, {self.rows} rows read, {self.written} points written "
+                     f"in {elapsed:.1f} s ({self.rows / elapsed:.0f} rows/s, {self.bytes / 1e6 / elapsed:.1f} MB/s).")
+
+    def summary(self):
+        self.log(force=True)
+        skipped = ', '.join(f"{count} {reason}" for reason, count in self.skipped.items() if count)
+        logging.info(f"Backfill done: {self.duplicates} duplicate reports, {self.failed} failed reports, "
+                     f"{self.existing} points already stored" + (f", skipped rows: {skipped}." if skipped else "."))
+
+# Function to load reports from files, directories, zip archives, mbox files or maildirs.
+# Reports are parsed in a process pool and written in input order, so for points repeated by the last
+# recent_worksheets worksheets of a Piste the first one wins. Identical reports are only written once. Points go to InfluxDB, or to a
+# line protocol file when output is given. With check_existing, points InfluxDB already has are dropped.
+def run_backfill(paths, output=None, workers=None, check_existing=True):
+    workers = workers or os.cpu_count() or 1
+    if output:
+        client, writer = None, LineFileWriter(output)
+    else:
+        client, writer = connect_influx()
+
+    progress = BackfillProgress()
+    seen_reports = set()
+    # Timestamps of the latest worksheets per Piste
+    seen_points = {}
+    logging.info(f"Backfill started with {workers} workers.")
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = deque()
+            jobs = iter_jobs(paths)
+            while True:
+                # Keep a bounded number of reports in flight so memory does not grow with the backlog
+                for job in jobs:
+                    in_flight.append(pool.submit(backfill_report, job))
+                    if len(in_flight) >= workers * 4:
+                        break
+                if not in_flight:
+                    break
+                write_backfill_result(in_flight.popleft().result(), client, writer, progress, seen_reports, seen_points, check_existing)
+                progress.log()
+    finally:
+        writer.close()
+        if client:
+            client.close()
+    progress.summary()
+    return progress
+
+# Function to write the result of one report, dropping identical reports and points already written
+def write_backfill_result(result, client, writer, progress, seen_reports, seen_points, check_existing):
+    name, content_hash, size, rows, skipped, worksheets, error = result
+    if error:
+        logging.error(f"{name}: {error}")
+        progress.failed += 1
+        return
+    if content_hash in seen_reports:
+        logging.debug(f"{name} is a duplicate of an earlier report, skipping.")
+        progress.duplicates += 1
+        return
+    seen_reports.add(content_hash)
+    progress.add(size, rows, skipped)
+
+    written = 0
+    for piste_name, time_ns, lines in worksheets:
+        recent = seen_points.setdefault(piste_name, deque(maxlen=recent_worksheets))
+        new = ~np.isin(time_ns, np.concatenate(recent)) if recent else np.ones(len(time_ns), dtype=bool)
+        if check_existing and client is not None and new.any():
+            pending = time_ns[new]
+            try:
+                existing = existing_timestamps(client, config.influxdb_bucket, config.measurement_name, piste_name,
+                                               [from_ns(pending.min()), from_ns(pending.max())])
+            except DedupeUnavailable:
+                # Rewriting a stored point only overwrites it with the same values
+                logging.warning(f"{name}: writing {len(pending)} points of {piste_name} without the existence check.")
+                existing = set()
+            stored = new & np.isin(time_ns, [to_ns(timestamp) for timestamp in existing])
+            progress.existing += int(np.count_nonzero(stored))
+            new &= ~stored
+        for index in np.flatnonzero(new).tolist():
+            writer.add(lines[index])
+        recent.append(time_ns[new])
+        written += int(np.count_nonzero(new))
+    progress.written += written
+    logging.debug(f"{name}: {rows} rows read, {written} points written.")
@@ -0,0 +1,21 @@
+import os
+import pytz
+
+# Gmail credentials
+username = os.environ.get("MAIL_USER")
+app_password = os.environ.get("APP_PASSWORD")
+imap_host = 'imap.gmail.com'
+mailbox = 'INBOX'
+
+# InfluxDB credentials
+influxdb_url = os.environ.get("INFLUX_URL")
+influxdb_token = os.environ.get("INFLUX_TOKEN")
+influxdb_org = os.environ.get("INFLUX_ORG")
+influxdb_bucket = os.environ.get("INFLUX_BUCKET")
+measurement_name = 'monitorointi'
+
+# Threshold for excluding measurement
+threshold = 0.100
+
+# Timezone of data
+local_tz = pytz.timezone("Europe/Helsinki")  # Replace with the correct time zone
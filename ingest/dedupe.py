@@ -0,0 +1,51 @@
+import logging
+from datetime import timedelta
+from itertools import groupby
+from operator import attrgetter
+import numpy as np
+from influxdb_client.client.exceptions import InfluxDBError
+from urllib3.exceptions import HTTPError
+from .transform import from_ns, to_ns
+
+# Field that every stored point carries, used to read back one row per point
+key_field = 'DeltaZ'
+
+# Function to format a UTC datetime as a Flux time literal
+def flux_time(timestamp):
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+# Raised when InfluxDB cannot say which points it already has. A failed check must not be read as
+# "nothing stored", the caller decides whether to write anyway or to retry the report later.
+class DedupeUnavailable(Exception):
+    pass
+
+# Function to group streamed rows per worksheet, i.e. per Piste
+def group_by_piste(data_points):
+    return groupby(data_points, key=attrgetter('Piste'))
+
+# Function to fetch the timestamps already stored for one Piste within the given time span
+def existing_timestamps(client, bucket, measurement, piste_name, timestamps):
+    if not timestamps:
+        return set()
+
+    start = min(timestamps)
+    stop = max(timestamps) + timedelta(seconds=1)
+    query = f'''
+    from(bucket: "{bucket}")
+    |> range(start: {flux_time(start)}, stop: {flux_time(stop)})
+    |> filter(fn: (r) => r._measurement == "{measurement}" and r.Piste == "{piste_name}" and r._field == "{key_field}")
+    |> keep(columns: ["_time"])
+    '''
+    try:
+        result = client.query_api().query(query)
+    except (HTTPError, InfluxDBError) as e:
+        logging.error(f"Checking existing data points for {piste_name} failed: {e}")
+        raise DedupeUnavailable(str(e)) from e
+
+    return {record.get_time() for table in result for record in table.records}
+
+# Function to drop the pending rows of a worksheet that InfluxDB already has, returns the mask of new rows
+def new_rows(client, bucket, measurement, piste_name, worksheet, pending):
+    pending_times = worksheet.time_ns[pending]
+    existing = existing_timestamps(client, bucket, measurement, piste_name, [from_ns(pending_times.min()), from_ns(pending_times.max())])
+    return pending & ~np.isin(worksheet.time_ns, [to_ns(timestamp) for timestamp in existing])
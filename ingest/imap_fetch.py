@@ -0,0 +1,191 @@
+import base64
+import quopri
+import re
+from email.header import decode_header, make_header
+from urllib.parse import unquote
+
+# Messages per UID FETCH command, keeps command lines short and downloaded attachments bounded
+fetch_chunk_size = 50
+
+token_pattern = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"]+))', re.S)
+uid_pattern = re.compile(rb'UID (\d+)')
+uid_validity_pattern = re.compile(rb'UIDVALIDITY (\d+)')
+
+# Function to check if an attachment is a ReportPoints XML file
+def is_report_filename(filename):
+    return bool(filename) and 'ReportPoints' in filename and filename.endswith('.xml')
+
+# Function to split an IMAP response into tokens, literals arrive from imaplib as (prefix, literal) tuples
+def tokenize(data):
+    for item in data:
+        if isinstance(item, tuple):
+            prefix, literal = item
+        else:
+            prefix, literal = item, None
+        position = 0
+        while position < len(prefix):
+            match = token_pattern.match(prefix, position)
+            if not match or match.end() == position:
+                break
+            position = match.end()
+            opening, closing, quoted, literal_size, atom = match.groups()
+            if opening:
+                yield '('
+            elif closing:
+                yield ')'
+            elif quoted is not None:
+                yield re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', 'replace')
+            elif literal_size is not None:
+                yield literal.decode('utf-8', 'replace')
+            elif atom.upper() == b'NIL':
+                yield None
+            else:
+                yield atom.decode('ascii', 'replace')
+
+# Function to parse an IMAP response into nested lists of strings
+def parse_response(data):
+    stack = [[]]
+    for token in tokenize(data):
+        if token == '(':
+            stack.append([])
+        elif token == ')' and len(stack) > 1:
+            completed = stack.pop()
+            stack[-1].append(completed)
+        elif token != ')':
+            stack[-1].append(token)
+    return stack[0]
+
+# Function to turn a flat IMAP parameter list into a dict with lowercase keys
+def parameters(values):
+    if not isinstance(values, list):
+        return {}
+    return {str(key).lower(): value for key, value in zip(values[::2], values[1::2])}
+
+# Function to decode an RFC 2231 extended parameter value such as utf-8''name%C3%A4.xml
+def rfc2231_value(value):
+    parts = value.split("'", 2)
+    if len(parts) == 3:
+        return unquote(parts[2], encoding=parts[0] or 'utf-8', errors='replace')
+    return unquote(value)
+
+# Function to read the attachment filename of a body part, decoding RFC 2231 and RFC 2047 forms
+def part_filename(disposition_params, type_params):
+    for params in (disposition_params, type_params):
+        for key in ('filename', 'name'):
+            if params.get(key + '*'):
+                return rfc2231_value(params[key + '*'])
+            if params.get(key):
+                return str(make_header(decode_header(params[key])))
+    return None
+
+# Function to list the attachments in a BODYSTRUCTURE as (section, filename, encoding)
+def find_attachments(structure, section=''):
+    if isinstance(structure[0], list):
+        # Multipart: the child parts come first, followed by the subtype and extension data
+        attachments = []
+        number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            number += 1
+            attachments += find_attachments(child, f'{section}.{number}' if section else str(number))
+        return attachments
+
+    section = section or '1'
+    main_type = (structure[0] or '').lower()
+    sub_type = (structure[1] or '').lower()
+    if main_type == 'message' and sub_type == 'rfc822' and len(structure) > 8:
+        # A forwarded message: a single-part body of part N is section N.1
+        body = structure[8]
+        return find_attachments(body, section if isinstance(body[0], list) else f'{section}.1')
+
+    # Extension data starts after the basic fields, which are longer for text parts
+    extension = 8 if main_type == 'text' else 7
+    disposition = structure[extension + 1] if len(structure) > extension + 1 else None
+    if not isinstance(disposition, list):
+        return []
+    filename = part_filename(parameters(disposition[1] if len(disposition) > 1 else None), parameters(structure[2]))
+    return [(section, filename, (structure[5] or '7bit').lower())]
+
+# Function to decode a body part according to its Content-Transfer-Encoding
+def decode_part(payload, encoding):
+    if encoding == 'base64':
+        return base64.b64decode(payload)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(payload)
+    return payload
+
+# Function to read the UIDVALIDITY of the mailbox, UIDs are only stable while it stays the same
+def uid_validity(imap, mailbox='INBOX'):
+    status, data = imap.status(mailbox, '(UIDVALIDITY)')
+    match = uid_validity_pattern.search(data[0]) if status == 'OK' and data and data[0] else None
+    return match.group(1).decode() if match else '0'
+
+# Function to list the UIDs of unread messages
+def unseen_uids(imap):
+    status, data = imap.uid('SEARCH', None, 'UNSEEN')
+    if status != 'OK' or not data or not data[0]:
+        return []
+    return data[0].split()
+
+# Function to fetch the BODYSTRUCTURE of many messages in one command, returns {uid: structure}
+def fetch_structures(imap, uids):
+    status, data = imap.uid('FETCH', b','.join(uids), '(UID BODYSTRUCTURE)')
+    if status != 'OK':
+        return {}
+    structures = {}
+    response = parse_response([item for item in data if item is not None])
+    for attributes in response:
+        if not isinstance(attributes, list):
+            continue
+        values = parameters(attributes)
+        if 'uid' in values and 'bodystructure' in values:
+            structures[values['uid'].encode()] = values['bodystructure']
+    return structures
+
+# Function to fetch one body section from many messages in one command, returns {uid: payload}
+def fetch_section(imap, uids, section):
+    status, data = imap.uid('FETCH', b','.join(uids), f'(UID BODY.PEEK[{section}])')
+    if status != 'OK':
+        return {}
+    payloads = {}
+    for index, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        match = uid_pattern.search(item[0])
+        if not match and index + 1 < len(data) and isinstance(data[index + 1], bytes):
+            match = uid_pattern.search(data[index + 1])
+        if match:
+            payloads[match.group(1)] = item[1]
+    return payloads
+
+# Function to fetch only the ReportPoints attachments of the given messages, chunk by chunk.
+# Yields (uid, [(filename, content), ...]) for every message, also those without reports.
+def fetch_report_attachments(imap, uids, chunk_size=fetch_chunk_size):
+    for start in range(0, len(uids), chunk_size):
+        chunk = uids[start:start + chunk_size]
+        structures = fetch_structures(imap, chunk)
+
+        # Group the wanted parts by section so each section is fetched for all messages at once
+        wanted = {}
+        for uid in chunk:
+            if uid not in structures:
+                continue
+            for section, filename, encoding in find_attachments(structures[uid]):
+                if is_report_filename(filename):
+                    wanted.setdefault(section, []).append((uid, filename, encoding))
+
+        reports = {uid: [] for uid in chunk}
+        for section, parts in wanted.items():
+            payloads = fetch_section(imap, [uid for uid, _, _ in parts], section)
+            for uid, filename, encoding in parts:
+                if uid in payloads:
+                    reports[uid].append((filename, decode_part(payloads[uid], encoding)))
+
+        for uid in chunk:
+            yield uid, reports[uid]
+
+# Function to mark messages as read once their reports have been written
+def mark_seen(imap, uids):
+    if uids:
+        imap.uid('STORE', b','.join(uids), '+FLAGS', '(\\Seen)')
@@ -0,0 +1,73 @@
+import logging
+import os
+import select
+import ssl
+import time
+
+# Seconds to stay in one IDLE command, kept below the 29 minutes allowed by RFC 2177
+idle_timeout = int(os.environ.get("IMAP_IDLE_TIMEOUT", 540))
+
+# Seconds between NOOP polls on servers without IDLE support
+poll_interval = int(os.environ.get("IMAP_POLL_INTERVAL", 60))
+
+# Function to check if the server advertises the IDLE extension
+def supports_idle(imap):
+    return 'IDLE' in imap.capabilities
+
+# Function to check for response data already read past the socket. select() only sees the socket, so lines
+# waiting in the SSL layer or in imaplib's buffered reader would otherwise sleep until the IDLE timeout.
+# The reader is peeked without blocking: it returns buffered bytes, or tries one read from the socket.
+def has_buffered_data(imap):
+    if isinstance(imap.sock, ssl.SSLSocket) and imap.sock.pending():
+        return True
+    timeout = imap.sock.gettimeout()
+    imap.sock.settimeout(0)
+    try:
+        return bool(imap.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        imap.sock.settimeout(timeout)
+
+# Function to wait in IDLE until the server reports mailbox changes or the timeout passes.
+# Returns True if the server sent an untagged update, False on timeout.
+def idle(imap, timeout=idle_timeout):
+    tag = imap._new_tag()
+    imap.send(tag + b' IDLE\r\n')
+    response = imap.readline()
+    if not response.startswith(b'+'):
+        raise imap.error(f"IDLE rejected by server: {response!r}")
+
+    changed = False
+    deadline = time.monotonic() + timeout
+    while not changed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not has_buffered_data(imap):
+            readable, _, _ = select.select([imap.sock], [], [], remaining)
+            if not readable:
+                break
+        line = imap.readline()
+        if not line:
+            raise imap.abort("Connection closed during IDLE")
+        # Keepalives like '* OK Still here' do not change the mailbox
+        changed = not line.startswith(b'* OK')
+
+    imap.send(b'DONE\r\n')
+    while True:
+        line = imap.readline()
+        if not line:
+            raise imap.abort("Connection closed while ending IDLE")
+        if line.startswith(tag):
+            break
+    return changed
+
+# Function to block until new mail may have arrived, using IDLE or NOOP polling as a fallback
+def wait_for_mail(imap):
+    if supports_idle(imap):
+        if idle(imap):
+            logging.info("Mailbox changed, checking for new reports.")
+    else:
+        time.sleep(poll_interval)
+        imap.noop()
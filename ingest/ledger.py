@@ -0,0 +1,89 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Location of the ledger that remembers which messages and reports have been ingested
+ledger_path = os.environ.get("INGEST_LEDGER", "ingest_ledger.db")
+
+schema = '''
+CREATE TABLE IF NOT EXISTS messages (
+    message TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    content_hash TEXT PRIMARY KEY,
+    message TEXT,
+    filename TEXT,
+    status TEXT NOT NULL,
+    rows INTEGER,
+    written INTEGER,
+    updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS high_water (
+    content_hash TEXT NOT NULL,
+    piste TEXT NOT NULL,
+    last_time TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    PRIMARY KEY (content_hash, piste)
+);
+'''
+
+# Function to identify a report by its content, so a resent copy is recognised as well
+def report_hash(file_content):
+    return hashlib.sha256(file_content).hexdigest()
+
+# Function to build a mailbox-independent message key, UIDs are only unique within one UIDVALIDITY
+def message_key(uid_validity, uid):
+    return f"{uid_validity}/{uid.decode() if isinstance(uid, bytes) else uid}"
+
+# Function to timestamp ledger entries
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+# SQLite ledger of ingested messages and attachments, with a per-Piste high-water mark
+# for every attachment so an interrupted report resumes after the last written worksheet.
+# Safe to share between the fetch thread and the writer thread of the parallel pipeline.
+class IngestLedger:
+    def __init__(self, path=ledger_path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(schema)
+
+    def execute(self, query, parameters=()):
+        with self.lock, self.connection:
+            return self.connection.execute(query, parameters).fetchall()
+
+    def message_done(self, message):
+        return bool(self.execute("SELECT 1 FROM messages WHERE message = ? AND status = 'done'", (message,)))
+
+    def finish_message(self, message):
+        self.execute("INSERT OR REPLACE INTO messages (message, status, updated) VALUES (?, 'done', ?)", (message, utc_now()))
+
+    def is_done(self, content_hash):
+        return bool(self.execute("SELECT 1 FROM attachments WHERE content_hash = ? AND status = 'done'", (content_hash,)))
+
+    def start(self, content_hash, message, filename):
+        self.execute('''INSERT INTO attachments (content_hash, message, filename, status, updated) VALUES (?, ?, ?, 'started', ?)
+                        ON CONFLICT (content_hash) DO UPDATE SET updated = excluded.updated''',
+                     (content_hash, message, filename, utc_now()))
+
+    # Latest timestamp already written per Piste for an attachment, as UTC datetimes
+    def high_water(self, content_hash):
+        rows = self.execute("SELECT piste, last_time FROM high_water WHERE content_hash = ?", (content_hash,))
+        return {piste: datetime.fromisoformat(last_time) for piste, last_time in rows}
+
+    def mark_piste(self, content_hash, piste, last_time, rows):
+        self.execute('''INSERT INTO high_water (content_hash, piste, last_time, rows) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (content_hash, piste) DO UPDATE SET last_time = max(last_time, excluded.last_time), rows = rows + excluded.rows''',
+                     (content_hash, piste, last_time.isoformat(), rows))
+
+    def finish(self, content_hash, rows, written):
+        self.execute("UPDATE attachments SET status = 'done', rows = ?, written = ?, updated = ? WHERE content_hash = ?",
+                     (rows, written, utc_now(), content_hash))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,185 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import socket
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from . import config
+
+# Where run metrics go: a comma separated list of "influx", "prometheus" and "log", empty turns export off
+metrics_export = os.environ.get("METRICS_EXPORT", "")
+metrics_measurement = os.environ.get("METRICS_MEASUREMENT", "ingest_metrics")
+metrics_bucket = os.environ.get("METRICS_BUCKET") or config.influxdb_bucket
+# Directory of the node_exporter textfile collector, one <run>.prom file per run name
+metrics_textfile_dir = os.environ.get("METRICS_TEXTFILE_DIR", ".")
+# Opt-in profiling of a whole run: "cprofile", "tracemalloc" or both, comma separated
+metrics_profile = os.environ.get("METRICS_PROFILE", "")
+
+# Timers and counters of one run. Stage times are summed per stage name and may overlap when
+# stages run in different threads, counters hold rows, bytes and skip reasons.
+class RunMetrics:
+    def __init__(self, run):
+        self.run = run
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+
+    def add_time(self, name, seconds, calls=1):
+        with self.lock:
+            self.seconds[name] += seconds
+            self.calls[name] += calls
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def duration(self):
+        return time.time() - self.started
+
+    def points(self):
+        host = socket.gethostname()
+        timestamp = datetime.now(timezone.utc)
+        with self.lock:
+            points = [Point(metrics_measurement).tag('run', self.run).tag('host', host).tag('stage', name)
+                      .field('seconds', float(seconds)).field('calls', self.calls[name]).time(timestamp, WritePrecision.S)
+                      for name, seconds in sorted(self.seconds.items())]
+            total = Point(metrics_measurement).tag('run', self.run).tag('host', host).tag('stage', 'total') \
+                .field('seconds', float(self.duration())).time(timestamp, WritePrecision.S)
+            for name, value in sorted(self.counters.items()):
+                total.field(name, value)
+        return points + [total]
+
+    def prometheus_text(self):
+        labels = f'run="{self.run}"'
+        lines = ['# HELP monitorointi_stage_seconds Time spent in each stage of the last run.',
+                 '# TYPE monitorointi_stage_seconds gauge']
+        with self.lock:
+            lines += [f'monitorointi_stage_seconds{{{labels},stage="{name}"}} {seconds:.6f}' for name, seconds in sorted(self.seconds.items())]
+            lines += ['# HELP monitorointi_stage_calls Calls of each stage in the last run.',
+                      '# TYPE monitorointi_stage_calls gauge']
+            lines += [f'monitorointi_stage_calls{{{labels},stage="{name}"}} {calls}' for name, calls in sorted(self.calls.items())]
+            lines += ['# HELP monitorointi_run_total Rows, bytes and skip reasons counted in the last run.',
+                      '# TYPE monitorointi_run_total gauge']
+            lines += [f'monitorointi_run_total{{{labels},counter="{name}"}} {value}' for name, value in sorted(self.counters.items())]
+        lines += ['# HELP monitorointi_run_duration_seconds Wall time of the last run.',
+                  '# TYPE monitorointi_run_duration_seconds gauge',
+                  f'monitorointi_run_duration_seconds{{{labels}}} {self.duration():.6f}',
+                  '# HELP monitorointi_run_finished_seconds Unix time the last run finished.',
+                  '# TYPE monitorointi_run_finished_seconds gauge',
+                  f'monitorointi_run_finished_seconds{{{labels}}} {time.time():.0f}']
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        with self.lock:
+            stages = ', '.join(f"{name} {seconds:.3f} s" for name, seconds in sorted(self.seconds.items()))
+            counters = ', '.join(f"{name} {value}" for name, value in sorted(self.counters.items()))
+        return f"{self.run} run took {self.duration():.3f} s. Stages: {stages or 'none'}. Counters: {counters or 'none'}."
+
+# Metrics of the run in progress, shared by the modules of one process
+current = RunMetrics('ingest')
+
+# Function to start collecting a new run, returns its metrics
+def start_run(run):
+    global current
+    current = RunMetrics(run)
+    return current
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add_time(name, time.perf_counter() - started)
+
+def count(name, value=1):
+    if value:
+        current.count(name, value)
+
+# Function to time the work done inside a generator, i.e. the time spent waiting for each item
+def timed_iter(name, iterable):
+    iterator = iter(iterable)
+    calls = 0
+    spent = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                spent += time.perf_counter() - started
+                calls += 1
+            yield item
+    finally:
+        current.add_time(name, spent, calls)
+
+def write_textfile(metrics):
+    path = os.path.join(metrics_textfile_dir, f"{metrics.run}.prom")
+    # Written next to the target and renamed, the textfile collector must never read a partial file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as file:
+        file.write(metrics.prometheus_text())
+    os.replace(temporary_path, path)
+
+def write_points(metrics, client=None):
+    if client is None:
+        with InfluxDBClient(url=config.influxdb_url, token=config.influxdb_token, org=config.influxdb_org) as own_client:
+            return write_points(metrics, own_client)
+    client.write_api(write_options=SYNCHRONOUS).write(bucket=metrics_bucket, record=metrics.points())
+
+# Function to export the metrics of the current run to the configured targets.
+# Export problems are logged and never fail the run itself.
+def export(client=None, metrics=None):
+    metrics = metrics or current
+    targets = {target.strip() for target in metrics_export.split(',') if target.strip()}
+    logging.debug(metrics.summary())
+    if 'log' in targets:
+        logging.info(metrics.summary())
+    if 'prometheus' in targets:
+        try:
+            write_textfile(metrics)
+        except OSError as e:
+            logging.error(f"Writing the metrics textfile failed: {e}")
+    if 'influx' in targets:
+        try:
+            write_points(metrics, client)
+        except Exception as e:
+            logging.error(f"Writing metrics to InfluxDB failed: {e}")
+
+# Function to profile a whole run when METRICS_PROFILE asks for it. cProfile stats are written
+# to <run>.prof and their top entries logged, tracemalloc logs the peak and the largest allocations.
+@contextmanager
+def profiled(run):
+    modes = {mode.strip() for mode in metrics_profile.split(',') if mode.strip()}
+    profiler = cProfile.Profile() if 'cprofile' in modes else None
+    if 'tracemalloc' in modes:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(f"{run}.prof")
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+            logging.info(f"cProfile of the {run} run, full stats in {run}.prof:\n{output.getvalue()}")
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current_size, peak_size = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            top = '\n'.join(str(statistic) for statistic in snapshot.statistics('lineno')[:10])
+            logging.info(f"tracemalloc of the {run} run: peak {peak_size / 1e6:.1f} MB, largest allocations:\n{top}")
@@ -0,0 +1,105 @@
+import io
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+# Define the namespace map for XML parsing
+namespaces = {'ss': 'urn:schemas-microsoft-com:office:spreadsheet'}
+ss = '{' + namespaces['ss'] + '}'
+
+# Rows at the top of every worksheet table that hold the header, not measurements
+header_rows = 4
+
+# Column layout of a data row: field name and 1-based spreadsheet column
+row_schema = (
+    ('Istunto', 1),
+    ('Pvm', 2),
+    ('Y', 3),
+    ('X', 4),
+    ('Z', 5),
+    ('DeltaY', 6),
+    ('DeltaX', 7),
+    ('DeltaZ', 8),
+)
+
+# Columns that trade places when a worksheet has its Y and X axes flipped
+flipped_columns = {3: 4, 4: 3, 6: 7, 7: 6}
+
+column_count = max(column for _, column in row_schema)
+
+# Positions in the decoded cell list for each field, precomputed for both orientations
+normal_order = tuple(column - 1 for _, column in row_schema)
+flipped_order = tuple(flipped_columns.get(column, column) - 1 for _, column in row_schema)
+
+ReportRow = namedtuple('ReportRow', ['Piste'] + [name for name, _ in row_schema])
+
+# Function to read the cell texts of a row in one pass, honouring ss:Index column skips
+def row_cells(row):
+    values = [None] * column_count
+    column = 0
+    for cell in row:
+        if cell.tag != ss + 'Cell':
+            continue
+        index = cell.get(ss + 'Index')
+        column = int(index) if index else column + 1
+        if column > column_count:
+            break
+        data = cell.find(ss + 'Data')
+        if data is not None:
+            values[column - 1] = data.text
+    return values
+
+# Function to check if axes are flipped based on the Y and X columns of a row
+def is_flipped(values):
+    x_sample = values[3]
+    y_sample = values[2]
+    if x_sample and y_sample:
+        x_digits = len(x_sample.partition(',')[0])
+        y_digits = len(y_sample.partition(',')[0])
+        return x_digits < y_digits
+    return False
+
+# Function to map decoded cells onto a ReportRow based on detected orientation
+def decode_row(values, piste_name, flipped):
+    order = flipped_order if flipped else normal_order
+    return ReportRow(piste_name, *[values[i] for i in order])
+
+# Function to stream data rows out of a ReportPoints workbook, worksheet by worksheet.
+# Rows are cleared as soon as they are consumed so memory stays flat regardless of report size.
+# file_content is the workbook as bytes or a readable file object such as an mmap.
+def iter_report_rows(file_content):
+    source = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    context = ET.iterparse(source, events=('start', 'end'))
+    root = None
+    table = None
+    piste_name = None
+    row_number = 0
+    flipped = False
+
+    for event, elem in context:
+        if event == 'start':
+            if root is None:
+                root = elem
+            elif elem.tag == ss + 'Worksheet':
+                piste_name = None
+                row_number = 0
+                flipped = False
+            elif elem.tag == ss + 'Table':
+                table = elem
+            continue
+
+        if elem.tag == ss + 'Row':
+            row_number += 1
+            if row_number == 2:
+                piste_name = row_cells(elem)[0]
+            elif row_number > header_rows:
+                values = row_cells(elem)
+                if not flipped:
+                    flipped = is_flipped(values)
+                yield decode_row(values, piste_name, flipped)
+            elem.clear()
+            if table is not None:
+                table.remove(elem)
+        elif elem.tag == ss + 'Table':
+            table = None
+        elif elem.tag == ss + 'Worksheet':
+            root.clear()
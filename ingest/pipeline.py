@@ -0,0 +1,90 @@
+import logging
+import os
+import queue
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from . import metrics
+from .imap_fetch import fetch_report_attachments, mark_seen
+from .ledger import report_hash
+from .parse import iter_report_rows
+
+# Number of parser processes, 1 keeps the plain serial path
+workers = int(os.environ.get("INGEST_WORKERS", 1))
+
+# Marks the end of the stream on the writer queue
+end_of_reports = None
+
+# Function to parse and decode one attachment in a worker process, returns the rows and the parse time
+def parse_report(file_content):
+    started = time.perf_counter()
+    rows = list(iter_report_rows(file_content))
+    return rows, time.perf_counter() - started
+
+# Function run by the single writer thread: writes parsed reports in message order.
+# After a failure it keeps draining the queue without writing so the producer never blocks.
+def write_stage(reports, write_report, finish_message, written, errors):
+    while True:
+        item = reports.get()
+        if item is end_of_reports:
+            return
+        uid, attachments = item
+        if errors:
+            continue
+        try:
+            for filename, content_hash, future in attachments:
+                if future is None:
+                    continue
+                try:
+                    data_points, parse_seconds = future.result()
+                except ET.ParseError as e:
+                    logging.error(f"Error parsing XML file {filename}: {e}")
+                    metrics.count('reports_failed')
+                    continue
+                metrics.current.add_time('parse', parse_seconds)
+                write_report(uid, filename, content_hash, data_points)
+            finish_message(uid)
+            written.append(uid)
+        except Exception as e:
+            logging.error(f"Writing reports of message {uid.decode()} failed: {e}")
+            errors.append(e)
+
+# Function to process messages in three stages: the IMAP fetch in this thread feeds a process
+# pool for parsing, which feeds one writer thread through a bounded queue. Reports already in
+# the ingest ledger are not parsed again.
+def process_unseen_parallel(imap, uids, ledger, write_report, finish_message, workers=workers):
+    reports = queue.Queue(maxsize=workers * 2)
+    written = []
+    errors = []
+    writer_thread = threading.Thread(target=write_stage, args=(reports, write_report, finish_message, written, errors), name='influx-writer')
+    writer_thread.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            try:
+                for uid, attachments in metrics.timed_iter('imap_fetch', fetch_report_attachments(imap, uids)):
+                    if errors:
+                        break
+                    metrics.count('messages_fetched')
+                    parsing = []
+                    for filename, file_content in attachments:
+                        metrics.count('attachments_fetched')
+                        metrics.count('bytes_fetched', len(file_content))
+                        content_hash = report_hash(file_content)
+                        if ledger.is_done(content_hash):
+                            logging.info(f"{filename} has already been ingested, skipping.")
+                            metrics.count('reports_skipped')
+                            parsing.append((filename, content_hash, None))
+                        else:
+                            parsing.append((filename, content_hash, pool.submit(parse_report, file_content)))
+                    reports.put((uid, parsing))
+            finally:
+                reports.put(end_of_reports)
+                writer_thread.join()
+    finally:
+        # IMAP is only used from this thread, so messages are marked seen here after the writer is done
+        with metrics.stage('imap_store'):
+            mark_seen(imap, written)
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,111 @@
+import logging
+import xml.etree.ElementTree as ET
+import numpy as np
+from . import config, metrics
+from .dedupe import DedupeUnavailable, group_by_piste, new_rows
+from .ledger import report_hash
+from .parse import iter_report_rows
+from .transform import convert_worksheet, from_ns, to_ns
+from .write import write_worksheet
+
+# Function to write data to InfluxDB, returns the number of rows read and points written.
+# Each worksheet goes through the transform, dedupe and write stages as a whole.
+# Worksheets up to the high_water timestamp of their Piste were written by an earlier run and are skipped,
+# worksheet_done is called with the Piste, its latest timestamp and row count once a worksheet is flushed.
+# With alerts, the written points are also checked against the reference values without reading them back.
+def write_data_to_influx(client, writer, data_points, influxdb_bucket, high_water=None, worksheet_done=None, alerts=None):
+    rows = 0
+    written = 0
+    # Parsing happens while the row stream is consumed, so its time is taken from the stream itself
+    for piste_name, worksheet_points in group_by_piste(metrics.timed_iter('parse', data_points)):
+        worksheet_points = list(worksheet_points)
+        with metrics.stage('transform'):
+            worksheet = convert_worksheet(worksheet_points, config.local_tz, config.threshold)
+        rows += len(worksheet.rows)
+        metrics.count('rows_read', len(worksheet.rows))
+
+        pending = worksheet.valid_time
+        if not pending.all():
+            logging.warning(f"{np.count_nonzero(~pending)} rows of {piste_name} have an invalid timestamp, skipping them.")
+            metrics.count('skipped_invalid_time', int(np.count_nonzero(~pending)))
+        if high_water and piste_name in high_water:
+            resumed = pending & (worksheet.time_ns > to_ns(high_water[piste_name]))
+            metrics.count('skipped_already_ingested', int(np.count_nonzero(pending & ~resumed)))
+            pending = resumed
+        if not pending.any():
+            continue
+
+        # The spool keeps the points until InfluxDB is back, and rewriting a stored point only overwrites
+        # it with the same values, so while InfluxDB is down worksheets are spooled whole instead of holding up the mail
+        if writer.durable and not writer.influx_available():
+            logging.warning(f"InfluxDB is unavailable, spooling all {np.count_nonzero(pending)} pending points of {piste_name} without the existence check.")
+            metrics.count('dedupe_skipped')
+            new = pending
+        else:
+            # One existence query per worksheet covering its whole time span, then filter in memory
+            try:
+                with metrics.stage('dedupe'):
+                    new = new_rows(client, influxdb_bucket, config.measurement_name, piste_name, worksheet, pending)
+            except DedupeUnavailable:
+                if not writer.durable:
+                    raise
+                logging.warning(f"Spooling all {np.count_nonzero(pending)} pending points of {piste_name} without the existence check.")
+                metrics.count('dedupe_unavailable')
+                writer.mark_unavailable()
+                new = pending
+        if np.count_nonzero(pending) > np.count_nonzero(new):
+            logging.info(f"{np.count_nonzero(pending) - np.count_nonzero(new)} data points for {piste_name} already exist. Data not added.")
+            metrics.count('skipped_existing', int(np.count_nonzero(pending) - np.count_nonzero(new)))
+
+        exceeded = new & ~worksheet.within_threshold
+        if exceeded.any():
+            logging.warning(f"Threshold exceeded, skipping {np.count_nonzero(exceeded)} points of {piste_name}.")
+            metrics.count('skipped_threshold', int(np.count_nonzero(exceeded)))
+        missing = new & worksheet.within_threshold & ~worksheet.complete
+        if missing.any():
+            logging.warning(f"Required data fields are missing, skipping {np.count_nonzero(missing)} points of {piste_name}.")
+            metrics.count('skipped_missing_fields', int(np.count_nonzero(missing)))
+
+        selected = new & worksheet.within_threshold & worksheet.complete
+        with metrics.stage('write'):
+            worksheet_written = write_worksheet(writer, config.measurement_name, worksheet, selected)
+        written += worksheet_written
+        metrics.count('points_written', worksheet_written)
+        if alerts:
+            with metrics.stage('evaluate'):
+                alerts.evaluate(piste_name, worksheet, selected)
+
+        if worksheet_done:
+            # Wait until the points are stored before recording progress, so the ledger never runs ahead of InfluxDB
+            with metrics.stage('write'):
+                writer.confirm()
+            pending_times = worksheet.time_ns[pending]
+            worksheet_done(piste_name, from_ns(pending_times.max()), len(pending_times))
+
+    # Store whatever is left of this report before the caller records it as done
+    with metrics.stage('write'):
+        writer.confirm()
+    return rows, written
+
+# Function to write one report, recording its progress in the ingest ledger so an interrupted run resumes
+def write_report(client, writer, ledger, message, filename, content_hash, data_points, alerts=None):
+    if ledger.is_done(content_hash):
+        logging.info(f"{filename} has already been ingested, skipping.")
+        metrics.count('reports_skipped')
+        return
+    ledger.start(content_hash, message, filename)
+    mark_piste = lambda piste_name, last_time, count: ledger.mark_piste(content_hash, piste_name, last_time, count)
+    try:
+        rows, written = write_data_to_influx(client, writer, data_points, config.influxdb_bucket, ledger.high_water(content_hash), mark_piste, alerts)
+    except ET.ParseError as e:
+        logging.error(f"Error parsing XML file {filename}: {e}")
+        metrics.count('reports_failed')
+        return
+    ledger.finish(content_hash, rows, written)
+    metrics.count('reports_written')
+    logging.info(f"{filename}: {rows} rows read, {written} points written.")
+
+# Function to process XML file and extract data points, unless the ledger shows it was ingested already
+def process_xml_file(file_content, client, writer, ledger, message, filename, alerts=None):
+    # Rows are streamed straight from the attachment into the writer, one worksheet after another
+    write_report(client, writer, ledger, message, filename, report_hash(file_content), iter_report_rows(file_content), alerts)
@@ -0,0 +1,139 @@
+import imaplib
+import logging
+import signal
+import sys
+import time
+from . import config, metrics
+from .dedupe import DedupeUnavailable
+from .imap_fetch import fetch_report_attachments, mark_seen, uid_validity, unseen_uids
+from .imap_idle import wait_for_mail
+from .ledger import IngestLedger, message_key
+from .pipeline import process_unseen_parallel
+from .report import process_xml_file, write_report
+from .write import WriteFailed, connect_influx
+
+# Longest wait between reconnect attempts in daemon mode, in seconds
+max_reconnect_delay = 300
+
+# Function to initialize IMAP and login
+def connect_imap():
+    imap = imaplib.IMAP4_SSL(config.imap_host)
+    imap.login(config.username, config.app_password)
+    imap.select(config.mailbox)
+    return imap
+
+# Function to close the IMAP connection
+def close_imap(imap):
+    try:
+        imap.close()
+        imap.logout()
+    except (imaplib.IMAP4.error, OSError) as e:
+        logging.warning(f"Closing IMAP connection failed: {e}")
+
+# Function to process all unread emails with ReportPoints attachments.
+# Only the matching attachment parts are downloaded, and a message is marked seen once its reports are written.
+# Messages the ingest ledger already knows are marked seen without downloading them again.
+# With alerts, fresh points are checked against the reference values as they are written.
+def process_unseen(imap, client, writer, ledger, workers=1, alerts=None):
+    with metrics.stage('imap_search'):
+        validity = uid_validity(imap, config.mailbox)
+        unseen = unseen_uids(imap)
+    pending = []
+    processed = []
+    for uid in unseen:
+        if ledger.message_done(message_key(validity, uid)):
+            processed.append(uid)
+        else:
+            pending.append(uid)
+    if processed:
+        logging.info(f"{len(processed)} unread messages have already been ingested, marking them seen.")
+        metrics.count('messages_skipped', len(processed))
+
+    finish_message = lambda uid: ledger.finish_message(message_key(validity, uid))
+    if workers > 1:
+        with metrics.stage('imap_store'):
+            mark_seen(imap, processed)
+        write = lambda uid, filename, content_hash, data_points: write_report(client, writer, ledger, message_key(validity, uid), filename, content_hash, data_points, alerts)
+        process_unseen_parallel(imap, pending, ledger, write, finish_message, workers)
+        return
+
+    try:
+        for uid, attachments in metrics.timed_iter('imap_fetch', fetch_report_attachments(imap, pending)):
+            metrics.count('messages_fetched')
+            for filename, file_content in attachments:
+                metrics.count('attachments_fetched')
+                metrics.count('bytes_fetched', len(file_content))
+                # Process XML file and extract data points
+                process_xml_file(file_content, client, writer, ledger, message_key(validity, uid), filename, alerts)
+            finish_message(uid)
+            processed.append(uid)
+    finally:
+        with metrics.stage('imap_store'):
+            mark_seen(imap, processed)
+
+# Function to process unread emails once, as run from cron
+def run_once(workers=1, alerts=None):
+    logging.info("Script started.")
+    metrics.start_run('ingest')
+    with metrics.stage('imap_connect'):
+        imap = connect_imap()
+    client, writer = connect_influx()
+    ledger = IngestLedger()
+    try:
+        process_unseen(imap, client, writer, ledger, workers, alerts)
+        if alerts:
+            alerts.dispatch()
+    finally:
+        close_imap(imap)
+        ledger.close()
+        # Flush remaining points and close the InfluxDB client
+        with metrics.stage('write'):
+            writer.close()
+        metrics.export(client)
+        client.close()
+    logging.info("Script execution completed.")
+
+# Function to keep one IMAP session open and process new reports as soon as they arrive.
+# The InfluxDB client is created once and reused, the IMAP session is re-established after drops.
+def run_daemon(workers=1, alerts=None):
+    logging.info("Daemon started.")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    client, writer = connect_influx()
+    ledger = IngestLedger()
+    imap = None
+    reconnect_delay = 1
+    try:
+        while True:
+            try:
+                # Every pass over the inbox is exported as one run
+                metrics.start_run('ingest')
+                if imap is None:
+                    with metrics.stage('imap_connect'):
+                        imap = connect_imap()
+                    logging.info("IMAP session established.")
+                process_unseen(imap, client, writer, ledger, workers, alerts)
+                if alerts:
+                    # Sent once per pass, so the breaches of all new reports share one digest per location
+                    alerts.dispatch()
+                metrics.export(client)
+                reconnect_delay = 1
+                wait_for_mail(imap)
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.error(f"IMAP connection lost: {e}. Reconnecting in {reconnect_delay} s.")
+                if imap is not None:
+                    close_imap(imap)
+                    imap = None
+                time.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+            except (DedupeUnavailable, WriteFailed):
+                # The unfinished messages stay unseen and are picked up again on the next pass
+                logging.error(f"InfluxDB is not answering, trying again in {reconnect_delay} s.")
+                time.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, max_reconnect_delay)
+    finally:
+        if imap is not None:
+            close_imap(imap)
+        writer.close()
+        client.close()
+        ledger.close()
+        logging.info("Daemon stopped.")
@@ -0,0 +1,193 @@
+import fcntl
+import gzip
+import itertools
+import logging
+import os
+import threading
+import time
+from influxdb_client import WritePrecision
+from . import metrics
+
+# Spool mode settings: where segments are kept, how many lines one drain request carries,
+# and the backoff between failed drain attempts in seconds
+spool_dir = os.environ.get("INGEST_SPOOL", "spool")
+drain_batch_size = int(os.environ.get("INGEST_SPOOL_BATCH", 50000))
+drain_retry_delay = float(os.environ.get("INGEST_SPOOL_RETRY", 5))
+max_drain_retry_delay = float(os.environ.get("INGEST_SPOOL_MAX_RETRY", 300))
+
+segment_suffix = '.lp.gz'
+segment_counter = itertools.count()
+
+# Function to list finished segments, oldest first
+def list_segments(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.endswith(segment_suffix))
+
+# Function to write lines as one gzip compressed segment. The segment is written under a temporary
+# name, synced and then renamed, so a finished segment is always complete.
+def write_segment(directory, lines):
+    name = f"{time.time_ns():020d}-{os.getpid()}-{next(segment_counter):06d}{segment_suffix}"
+    path = os.path.join(directory, name)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as file:
+        with gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6) as compressed:
+            compressed.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    # Sync the directory as well so the rename survives a power cut
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+    return path
+
+def read_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return [line for line in file.read().split('\n') if line]
+
+# Replays spooled segments to InfluxDB from a background thread. Segments are combined into requests
+# of about batch_size lines and deleted once written. After a failure the drainer backs off exponentially,
+# the writes themselves are not retried. Only one process drains a spool directory at a time, the others
+# keep trying to take over the lock. healthy tells whether the last write that was attempted succeeded.
+class SpoolDrainer:
+    def __init__(self, write_api, bucket, directory=spool_dir, batch_size=drain_batch_size):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.directory = directory
+        self.batch_size = batch_size
+        self.wake = threading.Event()
+        self.closing = False
+        self.healthy = True
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, '.drain.lock'), 'w')
+        self.has_lock = False
+        self.thread = threading.Thread(target=self.run, name='spool-drainer', daemon=True)
+        self.thread.start()
+
+    def notify(self):
+        self.wake.set()
+
+    def take_lock(self):
+        if not self.has_lock:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.has_lock = True
+            except OSError:
+                logging.debug(f"Another process is draining {self.directory}.")
+        return self.has_lock
+
+    # Function to write one batch of segments, returns False when nothing was left to drain
+    def drain_batch(self):
+        batch = []
+        lines = []
+        for path in list_segments(self.directory):
+            try:
+                segment_lines = read_segment(path)
+            except FileNotFoundError:
+                continue
+            except (OSError, EOFError) as e:
+                logging.error(f"Spool segment {path} is unreadable, moving it aside: {e}")
+                os.replace(path, f"{path}.bad")
+                continue
+            batch.append(path)
+            lines += segment_lines
+            if len(lines) >= self.batch_size:
+                break
+        if not batch:
+            return False
+
+        with metrics.stage('drain'):
+            if lines:
+                self.write_api.write(bucket=self.bucket, record=lines, write_precision=WritePrecision.NS)
+        for path in batch:
+            os.remove(path)
+        metrics.count('spool_lines_drained', len(lines))
+        logging.debug(f"Drained {len(lines)} spooled points from {len(batch)} segments.")
+        return True
+
+    # Function to drain until the spool is empty, returns False if a write failed or another process holds the spool.
+    # An empty spool says nothing about InfluxDB, so only a successful write makes the drainer healthy again.
+    def drain(self):
+        if not self.take_lock():
+            return False
+        try:
+            while self.drain_batch():
+                self.healthy = True
+        except Exception as e:
+            logging.warning(f"Draining the spool to InfluxDB failed, keeping {len(list_segments(self.directory))} segments: {e}")
+            self.healthy = False
+        return self.healthy
+
+    def run(self):
+        delay = drain_retry_delay
+        while True:
+            self.wake.clear()
+            drained = self.drain()
+            if self.closing:
+                return
+            if drained:
+                delay = drain_retry_delay
+                # Segments can also come from other processes, so look again now and then
+                self.wake.wait(max_drain_retry_delay)
+            else:
+                self.wake.wait(delay)
+                delay = min(delay * 2, max_drain_retry_delay)
+
+    # Stops the thread after one more attempt. Whatever could not be written stays in the spool for the next run.
+    def close(self):
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        if self.healthy and self.has_lock and list_segments(self.directory):
+            # Picks up segments flushed while the last drain was already running, a single attempt
+            self.drain()
+        self.lock_file.close()
+        self.write_api.close()
+
+# Writer with the interface of BatchWriter that appends line protocol to the local spool instead of
+# sending it. A flush makes the buffered lines durable on disk, so progress recorded after a flush
+# (the ledger, marking mail seen) never depends on InfluxDB being reachable.
+class SpoolWriter:
+    # Points handed to this writer survive an InfluxDB outage
+    durable = True
+
+    def __init__(self, drainer, directory=spool_dir, segment_size=drain_batch_size):
+        self.drainer = drainer
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lines = []
+
+    # Function to tell whether the existence check is worth asking. After a failed check or write, the check
+    # is skipped until the drainer has written to InfluxDB again, so an outage costs one failed request per run.
+    def influx_available(self):
+        return self.drainer.healthy
+
+    def mark_unavailable(self):
+        self.drainer.healthy = False
+
+    def add(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.segment_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            with metrics.stage('spool_write'):
+                write_segment(self.directory, self.lines)
+            metrics.count('spool_segments_written')
+            self.lines = []
+            self.drainer.notify()
+
+    # Flushed lines are on disk, which is all progress has to wait for
+    def confirm(self):
+        self.flush()
+
+    # Spools what is left and gives the drainer one more chance to empty the spool
+    def close(self):
+        self.flush()
+        self.drainer.close()
@@ -0,0 +1,117 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Report timestamps look like '07-03-2024 09.59.42'
+timestamp_format = b'00-00-0000 00.00.00'
+digit_positions = [index for index, char in enumerate(timestamp_format) if char == ord('0')]
+separator_positions = [index for index, char in enumerate(timestamp_format) if char != ord('0')]
+timestamp_pattern = '%d-%m-%Y %H.%M.%S'
+
+# Field columns of the converted value matrix, in report order
+field_names = ('Y', 'X', 'Z', 'DeltaY', 'DeltaX', 'DeltaZ')
+coordinate_columns = [0, 1, 2]
+delta_columns = [3, 4, 5]
+
+# Line protocol field order (sorted by name, like Point writes them) as indices into field_names
+line_field_order = sorted(range(len(field_names)), key=lambda index: field_names[index])
+
+epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Characters that must be escaped in tag values of line protocol
+tag_escapes = str.maketrans({'\\': '\\\\', ',': '\\,', ' ': '\\ ', '=': '\\=', '\n': '\\n'})
+
+# UTC offsets in seconds per (zone, local hour since epoch), DST only changes on whole hours
+offset_cache = {}
+
+# Columnar form of one worksheet: epoch-ns timestamps, a float64 value matrix and validity masks
+Worksheet = namedtuple('Worksheet', ['rows', 'time_ns', 'values', 'valid_time', 'complete', 'within_threshold'])
+
+# Function to convert a UTC datetime to epoch nanoseconds
+def to_ns(timestamp):
+    return (timestamp - epoch) // timedelta(microseconds=1) * 1000
+
+# Function to convert epoch nanoseconds to a UTC datetime
+def from_ns(time_ns):
+    return epoch + timedelta(microseconds=int(time_ns) // 1000)
+
+# Function to look up the UTC offset of a local wall-clock hour, the same way pytz localize resolves it
+def utc_offset(local_tz, local_hour):
+    key = (local_tz.zone, local_hour)
+    if key not in offset_cache:
+        local_time = datetime(1970, 1, 1) + timedelta(hours=local_hour)
+        offset_cache[key] = int(local_tz.localize(local_time).utcoffset().total_seconds())
+    return offset_cache[key]
+
+# Function to parse report timestamps into epoch-ns UTC, returns the times and a validity mask
+def parse_timestamps(values, local_tz):
+    text = np.array([value if value and len(value) == len(timestamp_format) and value.isascii() else timestamp_format.decode() for value in values], dtype='S19')
+    chars = text.view(np.uint8).reshape(len(values), len(timestamp_format))
+    digits = chars[:, digit_positions].astype(np.int64) - ord('0')
+    valid = np.all((digits >= 0) & (digits <= 9), axis=1)
+    valid &= np.all(chars[:, separator_positions] == np.frombuffer(timestamp_format, np.uint8)[separator_positions], axis=1)
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    second = digits[:, 12] * 10 + digits[:, 13]
+    valid &= (month >= 1) & (month <= 12) & (year >= 1970) & (hour < 24) & (minute < 60) & (second < 60)
+
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0)
+    month_start = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    month_end = (months + 1).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    valid &= (day >= 1) & (day <= month_end - month_start)
+
+    local_seconds = np.where(valid, (month_start + day - 1) * 86400 + hour * 3600 + minute * 60 + second, 0)
+    # Values the fast path rejects, e.g. without zero padding like '7-3-2024 9.59.42', are parsed one by one
+    for index in np.flatnonzero(~valid).tolist():
+        try:
+            local_time = datetime.strptime(values[index], timestamp_pattern)
+        except (TypeError, ValueError):
+            continue
+        local_seconds[index] = (local_time - datetime(1970, 1, 1)) // timedelta(seconds=1)
+        valid[index] = True
+    hours, inverse = np.unique(local_seconds // 3600, return_inverse=True)
+    offsets = np.array([utc_offset(local_tz, int(local_hour)) for local_hour in hours], dtype=np.int64)
+    return (local_seconds - offsets[inverse].reshape(-1)) * 1_000_000_000, valid
+
+# Function to convert comma-decimal strings to float64, missing or malformed values become NaN
+def parse_floats(values):
+    text = np.char.replace(np.array([value or 'nan' for value in values], dtype=str), ',', '.')
+    try:
+        return text.astype(np.float64)
+    except ValueError:
+        converted = np.full(len(values), np.nan)
+        for index, value in enumerate(text):
+            try:
+                converted[index] = float(value)
+            except ValueError:
+                pass
+        return converted
+
+# Function to convert the rows of one worksheet into columns with validity and threshold masks
+def convert_worksheet(rows, local_tz, threshold):
+    time_ns, valid_time = parse_timestamps([row.Pvm for row in rows], local_tz)
+    values = np.column_stack([parse_floats([getattr(row, name) for row in rows]) for name in field_names]) if rows else np.empty((0, len(field_names)))
+    complete = np.all(np.isfinite(values[:, coordinate_columns]), axis=1)
+    within_threshold = np.all(np.abs(values[:, delta_columns]) <= threshold, axis=1)
+    return Worksheet(rows, time_ns, values, valid_time, complete, within_threshold)
+
+# Function to give the indices of the selected rows with repeated timestamps written once, the first row wins
+def unique_time_indices(worksheet, selected):
+    indices = np.flatnonzero(selected)
+    _, first = np.unique(worksheet.time_ns[indices], return_index=True)
+    return indices[np.sort(first)]
+
+# Function to emit line protocol for the selected rows of a worksheet straight from its arrays
+def worksheet_lines(measurement, worksheet, indices):
+    values = worksheet.values[indices][:, line_field_order].tolist()
+    times = worksheet.time_ns[indices].tolist()
+    names = [field_names[index] for index in line_field_order]
+    for index, row_values, time_ns in zip(indices.tolist(), values, times):
+        row = worksheet.rows[index]
+        tags = ''.join(f',{key}={value.translate(tag_escapes)}' for key, value in (('Istunto', row.Istunto), ('Piste', row.Piste)) if value)
+        fields = ','.join(f'{name}={value!r}' for name, value in zip(names, row_values))
+        yield f'{measurement}{tags} {fields} {time_ns}'
@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.exceptions import InfluxDBError
+from influxdb_client.client.write_api import WriteOptions, WriteType
+from urllib3.exceptions import HTTPError
+from . import config
+from .spool import SpoolDrainer, SpoolWriter
+from .transform import unique_time_indices, worksheet_lines
+
+# Write mode: "sync" sends one request per batch, "batching" hands batches to the client's background writer,
+# "spool" appends batches to a local spool that a background thread drains to InfluxDB
+write_mode = os.environ.get("INFLUX_WRITE_MODE", "sync")
+batch_size = int(os.environ.get("INFLUX_BATCH_SIZE", 5000))
+flush_interval = int(os.environ.get("INFLUX_FLUSH_INTERVAL", 1000))  # milliseconds
+max_retries = int(os.environ.get("INFLUX_MAX_RETRIES", 5))
+retry_interval = int(os.environ.get("INFLUX_RETRY_INTERVAL", 5000))  # milliseconds
+# Timeout of a single request. Queries are not retried, so an unreachable InfluxDB fails the existence check quickly
+request_timeout = int(os.environ.get("INFLUX_TIMEOUT", 10000))  # milliseconds
+
+# Function to build the write options for the configured write mode
+def write_options():
+    write_type = WriteType.batching if write_mode == "batching" else WriteType.synchronous
+    return WriteOptions(write_type=write_type,
+                        batch_size=batch_size,
+                        flush_interval=flush_interval,
+                        max_retries=max_retries,
+                        retry_interval=retry_interval)
+
+# Function to log batches the background writer gave up on
+def log_write_error(conf, data, exception):
+    logging.error(f"Writing batch to {conf[0]} failed: {exception}")
+
+# Function to create a write API for the configured write mode
+def create_write_api(client, options):
+    return client.write_api(write_options=options, error_callback=log_write_error)
+
+def create_client(retries=False):
+    return InfluxDBClient(url=config.influxdb_url, token=config.influxdb_token, org=config.influxdb_org, timeout=request_timeout, retries=retries)
+
+# Function to initialize the InfluxDB client and its batch writer. The returned client is for queries and
+# never retries. Synchronous writes go through a client of their own with the retry policy of the write options,
+# the background writer of batching mode retries batches itself.
+def connect_influx():
+    options = write_options()
+    client = create_client()
+    if write_mode == "spool":
+        # The drainer needs to know whether a write succeeded, so it always writes synchronously.
+        # It backs off between attempts on its own, so its writes are not retried either.
+        drainer = SpoolDrainer(create_write_api(client, options), config.influxdb_bucket)
+        return client, SpoolWriter(drainer, segment_size=options.batch_size)
+    if write_mode == "batching":
+        return client, BackgroundWriter(create_client(), options, config.influxdb_bucket)
+    write_client = create_client(options.to_retry_strategy())
+    writer = BatchWriter(create_write_api(write_client, options), config.influxdb_bucket, options.batch_size, write_client)
+    return client, writer
+
+# Function to write the selected rows of a worksheet, repeated timestamps are written once with the first row winning.
+# Returns the number of points written.
+def write_worksheet(writer, measurement, worksheet, selected):
+    indices = unique_time_indices(worksheet, selected)
+    for line in worksheet_lines(measurement, worksheet, indices):
+        writer.add(line)
+    return len(indices)
+
+# Raised when InfluxDB did not store points handed to a writer
+class WriteFailed(Exception):
+    pass
+
+# Collects line protocol and writes it to InfluxDB in batches of batch_size lines
+class BatchWriter:
+    # Points are lost if InfluxDB rejects them
+    durable = False
+
+    def __init__(self, write_api, bucket, batch_size=batch_size, client=None):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.batch_size = batch_size
+        # Client owned by this writer, closed with it
+        self.client = client
+        self.lines = []
+
+    def add(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    # A failed write raises WriteFailed. The lines are dropped, the ledger has not recorded them and they are read again.
+    def flush(self):
+        if self.lines:
+            try:
+                self.write_api.write(bucket=self.bucket, record=self.lines, write_precision=WritePrecision.NS)
+            except (HTTPError, InfluxDBError) as e:
+                logging.error(f"Writing {len(self.lines)} points to InfluxDB failed: {e}")
+                raise WriteFailed(str(e)) from e
+            finally:
+                self.lines = []
+
+    # Function to make sure everything added so far is stored before progress is recorded.
+    # Synchronous writes raise when they fail, so a flush is enough.
+    def confirm(self):
+        self.flush()
+
+    # Final flush on shutdown, also waits for the background writer to drain in batching mode
+    def close(self):
+        self.flush()
+        self.write_api.close()
+        if self.client:
+            self.client.close()
+
+# BatchWriter for batching mode. The client's background writer only queues points and reports failed
+# batches to a callback, so confirm() closes it, which waits until the queued batches are sent, checks
+# that every point was acknowledged and starts a new background writer for the points that follow.
+class BackgroundWriter(BatchWriter):
+    def __init__(self, client, options, bucket):
+        self.options = options
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.acknowledged = 0
+        super().__init__(self.start(client), bucket, options.batch_size, client)
+
+    def start(self, client):
+        return client.write_api(write_options=self.options, success_callback=self.written, error_callback=log_write_error)
+
+    def written(self, conf, data):
+        with self.lock:
+            self.acknowledged += data.count(b'\n') + 1
+
+    def flush(self):
+        self.queued += len(self.lines)
+        super().flush()
+
+    def confirm(self):
+        self.flush()
+        with self.lock:
+            if self.acknowledged == self.queued:
+                return
+        self.write_api.close()
+        with self.lock:
+            missing = self.queued - self.acknowledged
+            self.queued = self.acknowledged = 0
+        self.write_api = self.start(self.client)
+        if missing:
+            raise WriteFailed(f"InfluxDB did not acknowledge {missing} points.")
@@ -0,0 +1,100 @@
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+# Rolling statistics per Piste and axis, kept next to the reference values
+stats_path = os.environ.get("REFERENCE_STATS", "reference_stats.json")
+# Weight of the newest sample in the exponentially weighted mean and variance
+ewma_alpha = float(os.environ.get("REFERENCE_EWMA_ALPHA", 0.05))
+# How far back the very first run reads, as a Flux duration
+initial_history = os.environ.get("REFERENCE_HISTORY", "30d")
+# Each run reads again this far behind the watermark, in seconds, to pick up points that were written late
+watermark_overlap = int(os.environ.get("REFERENCE_OVERLAP", 3600))
+
+delta_fields = ('DeltaX', 'DeltaY', 'DeltaZ')
+
+def format_time(timestamp):
+    return timestamp.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def parse_time(text):
+    return datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+
+# Function to fold one sample into the statistics of an axis: Welford's running mean and variance
+# over all samples, and an exponentially weighted mean and variance that follow slow drift.
+def add_sample(axis, value, alpha=ewma_alpha):
+    axis['count'] += 1
+    difference = value - axis['mean']
+    axis['mean'] += difference / axis['count']
+    axis['m2'] += difference * (value - axis['mean'])
+    if axis['count'] == 1:
+        axis['ewma'] = value
+        axis['ewmvar'] = 0.0
+    else:
+        difference = value - axis['ewma']
+        increment = alpha * difference
+        axis['ewma'] += increment
+        axis['ewmvar'] = (1 - alpha) * (axis['ewmvar'] + difference * increment)
+    axis['last'] = value
+
+def new_axis():
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'ewma': 0.0, 'ewmvar': 0.0, 'last': None, 'last_time': None}
+
+# Rolling per-Piste/axis statistics with a watermark, so every run only reads points newer than the
+# previous one and the history never has to be scanned again. Each axis also remembers its newest
+# sample time, which keeps points read twice because of the overlap from being counted twice.
+class ReferenceStats:
+    def __init__(self, path=stats_path):
+        self.path = path
+        try:
+            with open(path, 'r') as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            state = {}
+        self.watermark = parse_time(state['watermark']) if state.get('watermark') else None
+        self.points = state.get('points', {})
+
+    # Function to give the start of the next read as a Flux time, or a relative range on the first run
+    def query_start(self):
+        if self.watermark is None:
+            return f"-{initial_history}"
+        return format_time(self.watermark - timedelta(seconds=watermark_overlap))
+
+    # Function to add one stored point, returns False if it was already counted
+    def add(self, piste, field, value, timestamp, session=None):
+        point = self.points.setdefault(piste, {'session': session})
+        axis = point.setdefault(field, new_axis())
+        time_text = format_time(timestamp)
+        if axis['last_time'] is not None and time_text <= axis['last_time']:
+            return False
+        add_sample(axis, value)
+        axis['last_time'] = time_text
+        if session is not None:
+            point['session'] = session
+        if self.watermark is None or timestamp > self.watermark:
+            self.watermark = timestamp
+        return True
+
+    # Function to derive reference values from the statistics: "last", "mean" or "ewma"
+    def references(self, mode='ewma'):
+        references = {}
+        for piste, point in self.points.items():
+            values = {field: round(point[field][mode], 6) for field in delta_fields if field in point and point[field]['count']}
+            if values:
+                references[piste] = {'session': point.get('session'), **values}
+        return references
+
+    # Function to give the exponentially weighted standard deviation of an axis, None before two samples
+    def deviation(self, piste, field):
+        axis = self.points.get(piste, {}).get(field)
+        if not axis or axis['count'] < 2:
+            return None
+        return math.sqrt(axis['ewmvar'])
+
+    # Function to save the state, written to a temporary file first so a crash never leaves it half written
+    def save(self):
+        state = {'watermark': format_time(self.watermark) if self.watermark else None, 'points': self.points}
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(state, file, indent=1)
+        os.replace(temporary_path, self.path)
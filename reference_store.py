@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime
+import pytz
+
+# Reference values are read from a JSON file, or from SQLite when the path ends in .db/.sqlite
+reference_file_path = os.environ.get("REFERENCE_STORE", "reference_values.json")
+sqlite_suffixes = ('.db', '.sqlite', '.sqlite3')
+
+delta_fields = ('DeltaX', 'DeltaY', 'DeltaZ')
+helsinki_timezone = pytz.timezone('Europe/Helsinki')
+
+# One reference point as used by the alert checks: the timestamp is parsed and the location resolved once
+# when the store is loaded, and a missing axis reads as 0 like before.
+ReferencePoint = namedtuple('ReferencePoint', ['session', 'timestamp', 'updated', 'location'] + list(delta_fields))
+
+def determine_location(piste):
+    if piste.startswith("8"):
+        return "Gummeruksenkatu"
+    elif piste.startswith("48"):
+        return "Ponttiseinä"
+    elif piste.startswith("4"):
+        return "Kilpisenkatu"
+    return "Unknown location"
+
+# Function to parse a stored UTC timestamp into Helsinki time, None if it is missing
+def parse_timestamp(timestamp):
+    if not timestamp or timestamp == 'N/A':
+        return None
+    return datetime.fromisoformat(timestamp.rstrip('Z')).replace(tzinfo=pytz.utc).astimezone(helsinki_timezone)
+
+def utc_timestamp():
+    return datetime.utcnow().isoformat() + 'Z'
+
+def build_index(reference_values):
+    return {
+        piste: ReferencePoint(info.get('session'), info.get('timestamp', 'N/A'), parse_timestamp(info.get('timestamp')),
+                              determine_location(piste), *(info.get(field, 0) for field in delta_fields))
+        for piste, info in reference_values.items()
+    }
+
+# Function to merge new values into the stored ones, returns only the points whose session or values changed.
+# Changed points get a new timestamp unless one is given, unchanged points are left exactly as they were.
+def changed_points(reference_values, updates):
+    changed = {}
+    for piste, values in updates.items():
+        current = reference_values.get(piste, {})
+        if any(current.get(key) != value for key, value in values.items()):
+            changed[piste] = {**current, 'timestamp': utc_timestamp(), **values}
+    return changed
+
+# Reference values in a JSON file. The parsed file is cached and only read again when its mtime or size
+# changes, and only parsed again when its content hash changes. Updates are written to a temporary file
+# and renamed over the old one, so readers never see a half written file.
+class JsonReferenceStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.signature = None
+        self.content_hash = None
+        self.reference_values = {}
+        self.index = {}
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.signature, self.content_hash, self.reference_values, self.index = None, None, {}, {}
+            return
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self.signature:
+            return
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash != self.content_hash:
+            self.reference_values = json.loads(content) if content.strip() else {}
+            self.index = build_index(self.reference_values)
+            self.content_hash = content_hash
+        self.signature = signature
+
+    def load(self):
+        with self.lock:
+            self.refresh()
+            return self.index
+
+    def values(self):
+        with self.lock:
+            self.refresh()
+            return {piste: dict(info) for piste, info in self.reference_values.items()}
+
+    # Function to store new values per Piste, returns the list of points that changed
+    def update(self, updates):
+        with self.lock:
+            self.refresh()
+            changed = changed_points(self.reference_values, updates)
+            if not changed:
+                return []
+            reference_values = {**self.reference_values, **changed}
+            content = json.dumps(reference_values, indent=4).encode('utf-8')
+
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, 'wb') as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self.path)
+
+            stat = os.stat(self.path)
+            self.signature = (stat.st_mtime_ns, stat.st_size)
+            self.content_hash = hashlib.sha256(content).hexdigest()
+            self.reference_values = reference_values
+            self.index = {**self.index, **build_index(changed)}
+            return list(changed)
+
+    def close(self):
+        pass
+
+# Reference values in SQLite for installations with thousands of points. The index is cached until another
+# connection commits a change, and updates only write the rows of changed points in one transaction.
+class SQLiteReferenceStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS reference_values (
+                piste TEXT PRIMARY KEY,
+                session TEXT,
+                timestamp TEXT,
+                DeltaX REAL,
+                DeltaY REAL,
+                DeltaZ REAL
+            )''')
+        self.connection.commit()
+        self.data_version = None
+        self.reference_values = {}
+        self.index = {}
+
+    def refresh(self):
+        # data_version changes whenever another connection commits to the database
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return
+        rows = self.connection.execute("SELECT piste, session, timestamp, DeltaX, DeltaY, DeltaZ FROM reference_values")
+        self.reference_values = {}
+        for piste, session, timestamp, *deltas in rows:
+            info = {'session': session, 'timestamp': timestamp}
+            info.update((field, value) for field, value in zip(delta_fields, deltas) if value is not None)
+            self.reference_values[piste] = info
+        self.index = build_index(self.reference_values)
+        self.data_version = data_version
+
+    def load(self):
+        with self.lock:
+            self.refresh()
+            return self.index
+
+    def values(self):
+        with self.lock:
+            self.refresh()
+            return {piste: dict(info) for piste, info in self.reference_values.items()}
+
+    # Function to store new values per Piste, returns the list of points that changed
+    def update(self, updates):
+        with self.lock:
+            self.refresh()
+            changed = changed_points(self.reference_values, updates)
+            if not changed:
+                return []
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO reference_values (piste, session, timestamp, DeltaX, DeltaY, DeltaZ) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(piste, info.get('session'), info['timestamp'], *(info.get(field) for field in delta_fields))
+                     for piste, info in changed.items()])
+            self.reference_values.update(changed)
+            self.index = {**self.index, **build_index(changed)}
+            return list(changed)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# Stores are shared per path within a process, so repeated loads reuse the cached index
+stores = {}
+stores_lock = threading.Lock()
+
+def open_reference_store(path=None):
+    path = path or reference_file_path
+    with stores_lock:
+        if path not in stores:
+            stores[path] = SQLiteReferenceStore(path) if path.endswith(sqlite_suffixes) else JsonReferenceStore(path)
+        return stores[path]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy reference values from one store to another, e.g. from JSON to SQLite.")
+    parser.add_argument('source', help="reference store to read")
+    parser.add_argument('target', help="reference store to write")
+    args = parser.parse_args()
+
+    source = open_reference_store(args.source)
+    target = open_reference_store(args.target)
+    changed = target.update(source.values())
+    print(f"{len(changed)} reference points copied to {args.target}.")
@@ -1,7 +1,8 @@
-import json
-import datetime
+import argparse
 import os
 from influxdb_client import InfluxDBClient
+from reference_stats import ReferenceStats
+from reference_store import open_reference_store
 
 # Configuration
 influxdb_url = os.environ.get("INFLUX_URL")
@@ -9,49 +10,46 @@ influxdb_token = os.environ.get("INFLUX_TOKEN")
 influxdb_org = os.environ.get("INFLUX_ORG")
 influxdb_bucket = os.environ.get("INFLUX_BUCKET")
 
-reference_file_path = 'reference_values.json'
+# Which statistic becomes the reference value: "last" sample (the old behaviour), all-time "mean" or "ewma"
+reference_mode = os.environ.get("REFERENCE_MODE", "last")
 
 # Initialize InfluxDB client
 client = InfluxDBClient(url=influxdb_url, token=influxdb_token, org=influxdb_org)
 
-def load_reference_values():
-    try:
-        with open(reference_file_path, 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {}
-
-def save_reference_values(reference_values):
-    with open(reference_file_path, 'w') as file:
-        json.dump(reference_values, file, indent=4)
-
-def fetch_latest_point_values():
+# Function to fetch the stored points since the given Flux time, oldest first so the weighted statistics see them in order
+def fetch_point_values_since(start):
     query = f'''
     from(bucket: "{influxdb_bucket}")
-    |> range(start: -2h)
+    |> range(start: {start})
     |> filter(fn: (r) => r._measurement == "monitorointi")
     |> filter(fn: (r) => r._field == "DeltaX" or r._field == "DeltaY" or r._field == "DeltaZ")
-    |> last()
+    |> keep(columns: ["_time", "_value", "_field", "Piste", "Istunto"])
+    |> group()
+    |> sort(columns: ["_time"])
     '''
-    result = client.query_api().query(org=influxdb_org, query=query)
-    return result
-
-def update_reference_values():
-    reference_values = load_reference_values()
-    results = fetch_latest_point_values()
-
-    for table in results:
-        for record in table.records:
-            point = record.values['Piste']
-            if point not in reference_values:
-                reference_values[point] = {}
-            reference_values[point]['session'] = record.values['Istunto']
-            reference_values[point]['timestamp'] = datetime.datetime.utcnow().isoformat() + 'Z'  # Use UTC time for consistency
-            for field in ['DeltaX', 'DeltaY', 'DeltaZ']:
-                if field == record.get_field():
-                    reference_values[point][field] = record.get_value()
-
-    save_reference_values(reference_values)
+    return client.query_api().query_stream(org=influxdb_org, query=query)
+
+# Function to fold the points written since the last run into the rolling statistics and derive the
+# reference values from them. Only points newer than the stored watermark are read, so a run costs
+# the same however long the history grows. Only points whose session or values changed are rewritten.
+def update_reference_values(mode=reference_mode):
+    store = open_reference_store()
+    stats = ReferenceStats()
+
+    added = 0
+    for record in fetch_point_values_since(stats.query_start()):
+        if stats.add(record.values['Piste'], record.get_field(), record.get_value(), record.get_time(), record.values.get('Istunto')):
+            added += 1
+
+    # The statistics are saved before the reference values, so a crash in between never counts a point twice
+    stats.save()
+    changed = store.update(stats.references(mode))
+    print(f"{added} new values read, {len(changed)} reference points updated.")
 
 if __name__ == "__main__":
-    update_reference_values()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Update the reference values from the points stored since the last run.")
+    parser.add_argument('--mode', choices=['last', 'mean', 'ewma'], default=reference_mode,
+                        help="statistic used as the reference value (default: REFERENCE_MODE or last)")
+    args = parser.parse_args()
+
+    update_reference_values(args.mode)
\ No newline at end of file